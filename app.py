@@ -1,83 +1,205 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, current_app, session
+from flask import Flask, Blueprint, Markup, Response, abort, render_template, request, jsonify, redirect, url_for, flash, current_app, session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from flask_wtf import FlaskForm
+from flask_wtf.csrf import CSRFProtect
+from wtforms import StringField, PasswordField
+from wtforms.validators import DataRequired, Email
 from datetime import datetime, timedelta
+from functools import wraps
+import json
 import os
-import stripe
 from werkzeug.utils import secure_filename
-from models import db, User, Product, Order, OrderItem, Address
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from jinja2 import FileSystemBytecodeCache
+from models import db, User, Product, Order, OrderItem, Address, Topping, Customization, UserStats, ArchivedOrder
 from config import Config
-from flask_wtf.csrf import CSRFProtect
-
-stripe.api_key = Config.STRIPE_SECRET_KEY
-from forms import LoginForm, RegisterForm, ProductForm, EditProfileForm, AddressForm
-from flask_wtf.csrf import CSRFProtect
-from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
-from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, TextAreaField, FloatField, IntegerField, SelectField, FileField
-from wtforms.validators import DataRequired, Email, Length, NumberRange, Optional
-from flask_mail import Mail, Message
-from flask_sqlalchemy import SQLAlchemy
-from dotenv import load_dotenv
-
-load_dotenv()
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'dev'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ice_cream.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-
-# Initialize CSRF protection
-csrf = CSRFProtect(app)
-
-# Email configuration
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = os.environ.get('EMAIL_USER', 'your-email@gmail.com')
-app.config['MAIL_PASSWORD'] = os.environ.get('EMAIL_PASSWORD', 'your-app-password')
-app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('EMAIL_USER', 'your-email@gmail.com')
-
-# Initialize Flask-Mail
-mail = Mail(app)
-
-# Initialize CSRF protection
-csrf = CSRFProtect(app)
-
-# Ensure upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-# Initialize extensions
-db.init_app(app)
+from forms import LoginForm, RegisterForm, ProductForm, EditProfileForm, AddressForm, PRODUCT_CATEGORIES
+from user_cache import user_cache, CachedUser
+from ratelimit import auth_limiter
+from hashing import password_hasher, HasherBusy
+from search import search_products
+from catalog import parse_fields, list_products, DEFAULT_LIMIT, dumps as catalog_dumps
+from pricing import pricing, customization_error
+from fragment_cache import fragment_cache, catalog_version
+from events import order_events, event_stream
+from idempotency import new_key, valid_key, find_order
+from reservations import reservations, InsufficientStock, CheckoutError
+from order_summary import summarize
+from user_stats import record_order, record_status_change, record_status_changes
+from archive import get_order
+from product_import import read_rows, import_products, ProductImportError
+from recommendations import recommendations
+from dispatch import dispatch_board
+from kitchen import kitchen_queue, QUEUED_STATUSES
+from replica import replica_router, read_replica
+
+# Extensions are created unbound and attached to an app in create_app()
+csrf = CSRFProtect()
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
+
+bp = Blueprint('main', __name__)
+
+# Application factory. Importing this module opens no database connection
+# and does not import Stripe or Flask-Mail; tables and seed data are created
+# by the `flask init-db` command.
+def create_app(config_class=Config):
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+
+    # Ensure upload folder exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    # Compiled templates are stored on disk and shared by every worker, so a
+    # fresh worker loads bytecode instead of parsing and compiling Jinja source
+    cache_dir = app.config.get('JINJA_CACHE_DIR') or os.path.join(app.instance_path, 'jinja_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    # Initialize extensions
+    db.init_app(app)
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    user_cache.init_app(app)
+    auth_limiter.init_app(app)
+    password_hasher.init_app(app)
+    fragment_cache.init_app(app)
+    order_events.init_app(app)
+    reservations.init_app(app)
+    replica_router.init_app(app)
+    recommendations.init_app(app)
+    dispatch_board.init_app(app)
+    kitchen_queue.init_app(app)
+
+    app.register_blueprint(bp)
+
+    from init_db import (init_db_command, backfill_order_summaries_command, rebuild_user_stats_command,
+                         archive_orders_command, replicate_command, build_recommendations_command,
+                         import_products_command)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(backfill_order_summaries_command)
+    app.cli.add_command(rebuild_user_stats_command)
+    app.cli.add_command(archive_orders_command)
+    app.cli.add_command(replicate_command)
+    app.cli.add_command(build_recommendations_command)
+    app.cli.add_command(import_products_command)
+
+    return app
+
+# Load every template once so the first requests after a deploy or worker
+# restart don't pay for compiling them. Run before forking, workers inherit
+# the compiled templates.
+def warm_templates(app):
+    compiled = 0
+    for name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except Exception as e:
+            app.logger.warning('Could not precompile template %s: %s', name, e)
+    return compiled
+
+# Stripe is a heavy import, so load and configure it on first payment
+def get_stripe():
+    import stripe
+    stripe.api_key = current_app.config['STRIPE_SECRET_KEY']
+    return stripe
+
+# The cart is created lazily on first write so requests that never touch it
+# (static files, catalog APIs, anonymous pages) leave the session untouched
+def make_cart_key(product_id, customization=None):
+    return f"{product_id}_{json.dumps(customization or {})}"
+
+# Unit price of a product with the chosen size, container and toppings
+def customized_price(product, size=None, container=None, topping_ids=None):
+    return product.price + pricing.table().customization_price(size, container, topping_ids)
+
+# Build a cart line for a product, returning its cart key and contents
+def new_cart_line(product, quantity, size=None, container=None, topping_ids=None, extra_notes=''):
+    # Sorted ints, so the same selection always makes the same cart key
+    topping_ids = sorted({int(topping_id) for topping_id in topping_ids or []})
+    cart_item = {
+        'product_id': product.id,
+        'quantity': quantity,
+        'price': customized_price(product, size, container, topping_ids)
+    }
+
+    # Add customization if present
+    if size or container or topping_ids or extra_notes:
+        cart_item['customization'] = {
+            'size': size,
+            'container': container,
+            'topping_ids': topping_ids,
+            'extra_notes': extra_notes
+        }
+    return make_cart_key(product.id, cart_item.get('customization')), cart_item
+
+# Price every line of a cart, loading all of its products and toppings in
+# one query each
+def build_cart_items(cart):
+    product_ids = {int(cart_item['product_id']) for cart_item in cart.values()}
+    products = {}
+    if product_ids:
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids))}
+    topping_ids = {topping_id for cart_item in cart.values()
+                   for topping_id in cart_item.get('customization', {}).get('topping_ids') or []}
+    toppings = {}
+    if topping_ids:
+        toppings = {t.id: t.name for t in db.session.query(Topping.id, Topping.name).filter(Topping.id.in_(topping_ids))}
 
-# Initialize cart in session
-@app.before_request
-def initialize_cart():
-    if 'cart' not in session:
-        session['cart'] = {}
+    items = []
+    total = 0
+    for cart_key, cart_item in cart.items():
+        product = products.get(int(cart_item['product_id']))
+        if product:
+            quantity = cart_item['quantity']
+            price = cart_item['price']
+            item_total = price * quantity
+            item_data = {
+                'key': cart_key,
+                'id': product.id,
+                'name': product.name,
+                'price': price,
+                'quantity': quantity,
+                'total': item_total
+            }
+
+            # Add customization info if present, with its topping names
+            if 'customization' in cart_item:
+                customization = cart_item['customization']
+                item_data['customization'] = dict(customization, toppings=[
+                    {'id': topping_id, 'name': toppings[topping_id]}
+                    for topping_id in customization.get('topping_ids') or [] if topping_id in toppings
+                ])
+
+            items.append(item_data)
+            total += item_total
+    return items, total
+
+# Only the columns current_user needs are loaded, and the result is cached
+# per process so authenticated requests usually skip this query entirely
+def fetch_cached_user(user_id):
+    row = db.session.query(User.id, User.username, User.email, User.is_admin).filter_by(id=user_id).first()
+    return CachedUser(*row) if row else None
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
-
-# Create database tables
-with app.app_context():
-    db.create_all()
-    # Create admin user if it doesn't exist
-    if not User.query.filter_by(email='admin@example.com').first():
-        admin = User(
-            username='admin',
-            email='admin@example.com',
-            is_admin=True
-        )
-        admin.set_password('admin123')
-        db.session.add(admin)
-        db.session.commit()
+    return user_cache.get(int(user_id), fetch_cached_user)
+
+# Token-bucket throttle for password checks, per client IP and per account
+def auth_rate_limited(account=None):
+    if auth_limiter.allow(ip=request.remote_addr, account=account.lower() if account else None):
+        return False
+    flash('Too many attempts. Please wait a minute and try again.', 'danger')
+    return True
+
+# The password hashing pool is saturated; ask the user to retry rather than
+# queueing more CPU-bound work behind checkout requests
+@bp.app_errorhandler(HasherBusy)
+def password_hasher_busy(e):
+    flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'warning')
+    return redirect(request.url)
 
 # Admin login form
 class AdminLoginForm(FlaskForm):
@@ -90,100 +212,85 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated or not current_user.is_admin:
             flash('You need admin privileges to access this page.', 'danger')
-            return redirect(url_for('admin_login'))
+            return redirect(url_for('main.admin_login'))
         return f(*args, **kwargs)
     return decorated_function
 
 # Admin login route
-@app.route('/admin/login', methods=['GET', 'POST'])
+@bp.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     if current_user.is_authenticated and current_user.is_admin:
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
     
     form = AdminLoginForm()
     if form.validate_on_submit():
+        if auth_rate_limited(form.email.data):
+            return render_template('admin/login.html', form=form), 429
         user = User.query.filter_by(email=form.email.data).first()
         if user and user.is_admin and user.check_password(form.password.data):
             login_user(user)
             flash('Welcome back, Admin!', 'success')
-            return redirect(url_for('admin_dashboard'))
+            return redirect(url_for('main.admin_dashboard'))
         flash('Invalid email or password.', 'danger')
     return render_template('admin/login.html', form=form)
 
 # Admin logout route
-@app.route('/admin/logout')
+@bp.route('/admin/logout')
 @login_required
 def admin_logout():
     logout_user()
     flash('You have been logged out.', 'info')
-    return redirect(url_for('admin_login'))
+    return redirect(url_for('main.admin_login'))
 
 # Routes
-@app.route('/')
+# The product grid is rendered once per catalog version, locale and login
+# state and then served from the fragment cache; the surrounding page
+# (navbar, flashes) is still rendered per request
+def get_locale():
+    return request.accept_languages.best_match(current_app.config['LANGUAGES']) or current_app.config['LANGUAGES'][0]
+
+@bp.route('/')
+@read_replica
 def index():
-    products = Product.query.all()
-    return render_template('home.html', products=products)
+    key = ('product_grid', catalog_version(), get_locale(), current_user.is_authenticated)
+    product_grid = fragment_cache.get_or_render(
+        key,
+        lambda: render_template('partials/product_grid.html', products=Product.query.all())
+    )
+    return render_template('home.html', product_grid=Markup(product_grid))
 
-@app.route('/cart')
+@bp.route('/cart')
 def cart():
-    cart_items = []
-    total = 0
-    if 'cart' in session:
-        for cart_key, cart_item in session['cart'].items():
-            product_id = cart_item['product_id']
-            product = Product.query.get(int(product_id))
-            if product:
-                quantity = cart_item['quantity']
-                price = cart_item['price']
-                item_total = price * quantity
-                cart_item_data = {
-                    'id': product.id,
-                    'name': product.name,
-                    'price': price,
-                    'quantity': quantity,
-                    'total': item_total
-                }
-                
-                # Add customization info if present
-                if 'customization' in cart_item:
-                    customization = cart_item['customization']
-                    cart_item_data['customization'] = customization
-                    
-                    # Get topping names if topping_ids are present
-                    if 'topping_ids' in customization and customization['topping_ids']:
-                        toppings = Topping.query.filter(Topping.id.in_(customization['topping_ids'])).all()
-                        cart_item_data['customization']['toppings'] = [{'id': t.id, 'name': t.name} for t in toppings]
-                
-                # Add customization info if present
-                if 'customization' in cart_item:
-                    cart_item_data['customization'] = cart_item['customization']
-                
-                cart_items.append(cart_item_data)
-                total += item_total
-    return render_template('cart.html', cart_items=cart_items, total=total)
-
-@app.route('/login', methods=['GET', 'POST'])
+    cart_items, total = build_cart_items(session.get('cart', {}))
+    suggestions = recommended_products(recommendations.for_cart([item['id'] for item in cart_items]))
+    return render_template('cart.html', cart_items=cart_items, total=total, suggestions=suggestions)
+
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     form = LoginForm()
     if form.validate_on_submit():
+        if auth_rate_limited(form.email.data):
+            return render_template('login.html', form=form), 429
         user = User.query.filter_by(email=form.email.data).first()
         if user and user.check_password(form.password.data):
             login_user(user)
             next_page = request.args.get('next')
-            return redirect(next_page or url_for('index'))
+            return redirect(next_page or url_for('main.index'))
         flash('Invalid email or password', 'danger')
     return render_template('login.html', form=form)
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     form = RegisterForm()
     if form.validate_on_submit():
+        if auth_rate_limited(form.email.data):
+            return render_template('register.html', form=form), 429
         if User.query.filter_by(email=form.email.data).first():
             flash('Email already registered. Please use a different email or login.', 'danger')
             return render_template('register.html', form=form)
@@ -196,24 +303,25 @@ def register():
         db.session.add(user)
         db.session.commit()
         flash('Registration successful! Please login.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html', form=form)
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 # Admin routes
-@app.route('/admin')
+@bp.route('/admin')
 @login_required
 @admin_required
+@read_replica
 def admin_dashboard():
     products = Product.query.all()
     return render_template('admin/dashboard.html', products=products)
 
-@app.route('/admin/product/add', methods=['GET', 'POST'])
+@bp.route('/admin/product/add', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def add_product():
@@ -234,11 +342,12 @@ def add_product():
         )
         db.session.add(product)
         db.session.commit()
+        pricing.invalidate()
         flash('Product added successfully!', 'success')
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
     return render_template('admin/add_product.html', form=form)
 
-@app.route('/admin/product/edit/<int:id>', methods=['GET', 'POST'])
+@bp.route('/admin/product/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def edit_product(id):
@@ -248,7 +357,7 @@ def edit_product(id):
         if form.image.data:
             # Delete old image if it exists
             if product.image_url and product.image_url.startswith('/static/uploads/'):
-                old_image_path = os.path.join(app.root_path, product.image_url.lstrip('/'))
+                old_image_path = os.path.join(current_app.root_path, product.image_url.lstrip('/'))
                 if os.path.exists(old_image_path):
                     os.remove(old_image_path)
             
@@ -265,11 +374,12 @@ def edit_product(id):
         product.category = form.category.data
         product.stock = form.stock.data
         db.session.commit()
+        pricing.invalidate()
         flash('Product updated successfully!', 'success')
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
     return render_template('admin/edit_product.html', form=form, product=product)
 
-@app.route('/admin/product/delete/<int:id>', methods=['GET', 'POST'])
+@bp.route('/admin/product/delete/<int:id>', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def delete_product(id):
@@ -277,20 +387,22 @@ def delete_product(id):
     
     # Delete product image if it exists
     if product.image_url and product.image_url.startswith('/static/uploads/'):
-        image_path = os.path.join(app.root_path, product.image_url.lstrip('/'))
+        image_path = os.path.join(current_app.root_path, product.image_url.lstrip('/'))
         if os.path.exists(image_path):
             os.remove(image_path)
     
     db.session.delete(product)
     db.session.commit()
+    pricing.invalidate()
     
     if request.is_json:
         return jsonify({'status': 'success', 'message': 'Product deleted successfully'})
     flash('Product deleted successfully!', 'success')
-    return redirect(url_for('admin_dashboard'))
+    return redirect(url_for('main.admin_dashboard'))
 
 # API routes
-@app.route('/api/ice-creams')
+@bp.route('/api/ice-creams')
+@read_replica
 def get_ice_creams():
     products = Product.query.all()
     return jsonify([{
@@ -303,7 +415,34 @@ def get_ice_creams():
         'stock': p.stock
     } for p in products])
 
-@app.route('/api/contact', methods=['POST'])
+@bp.route('/api/v2/ice-creams')
+@read_replica
+def get_ice_creams_v2():
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    page = list_products(
+        fields,
+        category=request.args.get('category') or None,
+        after=request.args.get('after', type=int),
+        limit=request.args.get('limit', DEFAULT_LIMIT, type=int)
+    )
+    return current_app.response_class(catalog_dumps(page), mimetype='application/json')
+
+@bp.route('/api/search')
+@read_replica
+def search():
+    return jsonify(search_products(
+        q=request.args.get('q', ''),
+        category=request.args.get('category') or None,
+        min_price=request.args.get('min_price', type=float),
+        max_price=request.args.get('max_price', type=float),
+        page=request.args.get('page', 1, type=int),
+        per_page=request.args.get('per_page', 20, type=int)
+    ))
+
+@bp.route('/api/contact', methods=['POST'])
 def contact():
     data = request.json
     return jsonify({
@@ -320,20 +459,20 @@ def save_image(file):
         filename = secure_filename(file.filename)
         # Add timestamp to filename to make it unique
         filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         file.save(file_path)
         return f"/static/uploads/{filename}"
     return None
 
 # Cart routes
-@app.route('/api/cart/add', methods=['GET', 'POST'])
+@bp.route('/api/cart/add', methods=['GET', 'POST'])
 @login_required
 def add_to_cart():
     if request.method == 'GET':
         product_id = request.args.get('product_id')
         if not product_id:
             flash('Product ID is required', 'error')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         quantity = 1
         data = None
     else:
@@ -344,58 +483,29 @@ def add_to_cart():
         else:
             product_id = data.get('product_id')
             quantity = data.get('quantity', 1)
-    
+    data = data or {}
+    error = customization_error(data.get('size'), data.get('container'), data.get('toppings'))
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+
     product = Product.query.get_or_404(product_id)
-    if product.stock < quantity:
+    if available_stock(product) < quantity:
         return jsonify({
             'status': 'error',
             'message': 'Not enough stock available'
         }), 400
     
     # Handle customization data if present
-    size = data.get('size')
-    container = data.get('container')
-    topping_ids = data.get('toppings', [])
-    extra_notes = data.get('extra_notes', '')
-    
-    # Calculate total price
-    total_price = product.price
-    
-    # Add size price if customized
-    if size:
-        size_prices = {
-            'small': 0,
-            'medium': 20,
-            'large': 40
-        }
-        total_price += size_prices.get(size, 0)
-    
-    # Add toppings price if any
-    if topping_ids:
-        toppings = Topping.query.filter(Topping.id.in_(topping_ids)).all()
-        for topping in toppings:
-            total_price += topping.price
-    
+    cart_key, cart_item = new_cart_line(
+        product,
+        quantity,
+        size=data.get('size'),
+        container=data.get('container'),
+        topping_ids=data.get('toppings', []),
+        extra_notes=data.get('extra_notes', '')
+    )
+
     cart = session.get('cart', {})
-    cart_item = {
-        'product_id': product_id,
-        'quantity': quantity,
-        'price': total_price
-    }
-    
-    # Add customization if present
-    if size or container or topping_ids or extra_notes:
-        cart_item['customization'] = {
-            'size': size,
-            'container': container,
-            'topping_ids': topping_ids,
-            'extra_notes': extra_notes
-        }
-    
-    # Generate unique key for cart item
-    import json
-    cart_key = f"{product_id}_{json.dumps(cart_item.get('customization', {}))}"
-    
     if cart_key in cart:
         cart[cart_key]['quantity'] += quantity
     else:
@@ -407,53 +517,29 @@ def add_to_cart():
         'message': 'Item added to cart successfully'
     })
 
-@app.route('/api/cart/items')
+@bp.route('/api/cart/items')
 @login_required
 def get_cart_items():
-    cart = session.get('cart', {})
-    items = []
-    total = 0
-    
-    for cart_key, cart_item in cart.items():
-        product_id = cart_item['product_id']
-        product = Product.query.get(int(product_id))
-        if product:
-            quantity = cart_item['quantity']
-            price = cart_item['price']
-            item_total = price * quantity
-            item_data = {
-                'id': product.id,
-                'name': product.name,
-                'price': price,
-                'quantity': quantity,
-                'total': item_total
-            }
-            
-            # Add customization info if present
-            if 'customization' in cart_item:
-                item_data['customization'] = cart_item['customization']
-            
-            items.append(item_data)
-            total += item_total
-    
+    items, total = build_cart_items(session.get('cart', {}))
     return jsonify({
         'items': items,
         'total': total
     })
 
-@app.route('/api/cart/remove', methods=['POST'])
+@bp.route('/api/cart/remove', methods=['POST'])
 @login_required
 def remove_from_cart():
     data = request.json
     product_id = data.get('product_id')
     
     cart = session.get('cart', {})
-    # Find the cart key that matches the product_id
-    cart_key_to_remove = None
-    for cart_key, cart_item in cart.items():
-        if int(cart_item['product_id']) == int(product_id):
-            cart_key_to_remove = cart_key
-            break
+    # Prefer the exact cart line; fall back to the first line for the product
+    cart_key_to_remove = data.get('key') if data.get('key') in cart else None
+    if cart_key_to_remove is None and product_id is not None:
+        for cart_key, cart_item in cart.items():
+            if int(cart_item['product_id']) == int(product_id):
+                cart_key_to_remove = cart_key
+                break
     
     if cart_key_to_remove:
         del cart[cart_key_to_remove]
@@ -469,13 +555,110 @@ def remove_from_cart():
         'message': 'Item not found in cart'
     }), 404
 
-@app.route('/checkout')
+# Apply several cart changes at once and answer with the updated, priced cart
+# so the client needs a single round trip. Operations are applied in order to
+# a copy of the cart and nothing is saved unless all of them succeed.
+#
+#     {"operations": [
+#         {"op": "add", "product_id": 1, "quantity": 2, "size": "large", "toppings": [3]},
+#         {"op": "set_quantity", "key": "<cart line key>", "quantity": 3},
+#         {"op": "remove", "key": "<cart line key>"}
+#     ]}
+MAX_CART_OPERATIONS = 50
+
+@bp.route('/api/cart/batch', methods=['POST'])
+@login_required
+def update_cart_batch():
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or len(operations) > MAX_CART_OPERATIONS:
+        return jsonify({
+            'status': 'error',
+            'message': f'operations must be a list of at most {MAX_CART_OPERATIONS} changes'
+        }), 400
+
+    cart = {key: dict(line) for key, line in session.get('cart', {}).items()}
+    for index, operation in enumerate(operations):
+        error = apply_cart_operation(cart, operation)
+        if error:
+            return jsonify({
+                'status': 'error',
+                'message': error,
+                'operation': index
+            }), 400
+
+    session['cart'] = cart
+    items, total = build_cart_items(cart)
+    return jsonify({
+        'status': 'success',
+        'items': items,
+        'total': total
+    })
+
+# Applies one batch operation to the cart in place, returning an error message
+# when the operation is invalid
+def apply_cart_operation(cart, operation):
+    if not isinstance(operation, dict):
+        return 'Invalid operation'
+    op = operation.get('op')
+
+    if op == 'remove':
+        if cart.pop(operation.get('key'), None) is None:
+            return 'Item not found in cart'
+        return None
+
+    try:
+        quantity = int(operation.get('quantity', 1))
+        product_id = int(operation['product_id']) if op == 'add' else None
+    except (KeyError, TypeError, ValueError):
+        return 'Invalid product or quantity'
+
+    if op == 'add':
+        if quantity < 1:
+            return 'Quantity must be at least 1'
+        error = customization_error(operation.get('size'), operation.get('container'), operation.get('toppings'))
+        if error:
+            return error
+        product = db.session.get(Product, product_id)
+        if product is None:
+            return 'Product not found'
+        cart_key, cart_item = new_cart_line(
+            product,
+            quantity,
+            size=operation.get('size'),
+            container=operation.get('container'),
+            topping_ids=operation.get('toppings', []),
+            extra_notes=operation.get('extra_notes', '')
+        )
+        if cart_key in cart:
+            cart_item['quantity'] = cart[cart_key]['quantity'] + quantity
+        if available_stock(product) < cart_item['quantity']:
+            return 'Not enough stock available'
+        cart[cart_key] = cart_item
+        return None
+
+    if op == 'set_quantity':
+        cart_key = operation.get('key')
+        if cart_key not in cart:
+            return 'Item not found in cart'
+        if quantity < 1:
+            del cart[cart_key]
+            return None
+        product = db.session.get(Product, int(cart[cart_key]['product_id']))
+        if product is None or available_stock(product) < quantity:
+            return 'Not enough stock available'
+        cart[cart_key]['quantity'] = quantity
+        return None
+
+    return f'Unknown operation: {op}'
+
+@bp.route('/checkout')
 @login_required
 def checkout():
     cart = session.get('cart', {})
     if not cart:
         flash('Your cart is empty', 'warning')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     items = []
     total = 0
@@ -494,15 +677,17 @@ def checkout():
             })
             total += item_total
     
+    # Issue the checkout's idempotency key before any order can be placed
+    checkout_key()
     return render_template('checkout.html', items=items, total=total)
 
-@app.route('/process_checkout', methods=['POST'])
+@bp.route('/process_checkout', methods=['POST'])
 @login_required
 def process_checkout():
     cart = session.get('cart', {})
     if not cart:
         flash('Your cart is empty', 'warning')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     # Get delivery option
     delivery_option = request.form.get('delivery_option', 'pickup')
@@ -510,12 +695,12 @@ def process_checkout():
     
     if delivery_option == 'delivery':
         # Redirect to address form if delivery is selected
-        return redirect(url_for('delivery_address'))
+        return redirect(url_for('main.delivery_address'))
     else:
         # Skip address form for pickup
-        return redirect(url_for('payment'))
+        return redirect(url_for('main.payment'))
 
-@app.route('/delivery-address', methods=['GET', 'POST'])
+@bp.route('/delivery-address', methods=['GET', 'POST'])
 @login_required
 def delivery_address():
     # Check if user has default address
@@ -530,21 +715,21 @@ def delivery_address():
         
         if address_id == 'new':
             # Redirect to new address form
-            return redirect(url_for('new_address'))
+            return redirect(url_for('main.new_address'))
         
         # Store selected address in session
         session['address_id'] = address_id
-        return redirect(url_for('payment'))
+        return redirect(url_for('main.payment'))
     
     return render_template('delivery_address.html', addresses=addresses, default_address=default_address)
 
-@app.route('/new-address', methods=['GET', 'POST'])
+@bp.route('/new-address', methods=['GET', 'POST'])
 @login_required
 def new_address():
     form = AddressForm()
     return render_template('address_form.html', form=form)
 
-@app.route('/save-address', methods=['POST'])
+@bp.route('/save-address', methods=['POST'])
 @login_required
 def save_address():
     form = AddressForm()
@@ -575,11 +760,11 @@ def save_address():
         session['address_id'] = address.id
         
         flash('Address saved successfully!', 'success')
-        return redirect(url_for('payment'))
+        return redirect(url_for('main.payment'))
     
     return render_template('address_form.html', form=form)
 
-@app.route('/create-payment-intent', methods=['POST'])
+@bp.route('/create-payment-intent', methods=['POST'])
 @login_required
 def create_payment_intent():
     try:
@@ -594,6 +779,7 @@ def create_payment_intent():
                 total += product.price * quantity
 
         # Create a PaymentIntent with the order amount and currency
+        stripe = get_stripe()
         intent = stripe.PaymentIntent.create(
             amount=int(total * 100),  # Convert to cents
             currency='inr',
@@ -608,17 +794,18 @@ def create_payment_intent():
     except Exception as e:
         return jsonify({'error': str(e)}), 403
 
-@app.route('/payment')
+@bp.route('/payment')
 @login_required
 def payment():
     cart = session.get('cart', {})
     if not cart:
         flash('Your cart is empty', 'warning')
-        return redirect(url_for('cart'))
+        return redirect(url_for('main.cart'))
     
     # Get items and calculate total
     items = []
     total = 0
+    quantities = {}
     
     for cart_key, cart_item in cart.items():
         product_id = cart_item['product_id'] if isinstance(cart_item, dict) and 'product_id' in cart_item else cart_key.split('_')[0] if '_' in str(cart_key) else cart_key
@@ -633,6 +820,14 @@ def payment():
                 'total': item_total
             })
             total += item_total
+            quantities[product.id] = quantities.get(product.id, 0) + quantity
+
+    # Hold the cart's stock for this checkout while the customer pays
+    try:
+        reservations.reserve(checkout_key(), quantities)
+    except InsufficientStock as e:
+        flash(f'Sorry, only {e.available} of {e.product.name} left. Please update your cart.', 'warning')
+        return redirect(url_for('main.cart'))
     
     # Get delivery address if delivery option is selected
     address = None
@@ -640,35 +835,88 @@ def payment():
         address = Address.query.get(session.get('address_id'))
 
     return render_template('payment.html', 
-                          stripe_public_key=Config.STRIPE_PUBLIC_KEY,
+                          stripe_public_key=current_app.config['STRIPE_PUBLIC_KEY'],
                           total=total,
                           items=items,
-                          address=address)
+                          address=address,
+                          checkout_key=checkout_key(),
+                          reserved_minutes=reservations.ttl // 60)
 
-@app.route('/payment/success')
+@bp.route('/payment/success')
 @login_required
 def payment_success():
+    key = request.args.get('key')
+    # A reload, back-button or retried redirect returns the order this
+    # checkout already created without writing anything
+    order = find_order(key or session.get('checkout_key'), current_user.id)
+    if order:
+        return redirect(url_for('main.order_confirmation', order_id=order.id))
+
     cart = session.get('cart', {})
     if not cart:
         flash('Your cart is empty', 'warning')
-        return redirect(url_for('index'))
-    
-    # Create order
+        return redirect(url_for('main.index'))
+
+    # A paid order starts in the kitchen queue like any other; 'completed'
+    # was never an order status the queue or the admin controls knew
+    try:
+        order, created = place_cart_order(cart, 'pending', key)
+    except CheckoutError as e:
+        flash(f'{e}. Please update your cart.', 'warning')
+        return redirect(url_for('main.cart'))
+
+    # Clear cart
+    session.pop('cart', None)
+    session.pop('checkout_key', None)
+
+    if created:
+        flash('Payment successful! Your order has been placed.', 'success')
+    return redirect(url_for('main.order_confirmation', order_id=order.id))
+
+# Stock left for this session's cart, counting its own holds as free
+def available_stock(product):
+    key = session.get('checkout_key')
+    return reservations.available(product, key if valid_key(key) else None)
+
+# Key identifying the current checkout, issued when checkout starts and
+# kept in the session until an order is placed with it
+def checkout_key():
+    if not valid_key(session.get('checkout_key')):
+        session['checkout_key'] = new_key()
+    return session['checkout_key']
+
+# Creates an order from the cart, its items and stock updates in one
+# transaction. The idempotency key is unique, so when a concurrent replay of
+# the same checkout commits first, this one rolls back and returns that order.
+def place_cart_order(cart, status, key=None):
+    if not valid_key(key):
+        key = checkout_key()
     order = Order(
         user_id=current_user.id,
-        status='completed',
-        total_amount=0
+        status=status,
+        total_amount=0,
+        idempotency_key=key
     )
-    
+
     # Add delivery address if delivery option was selected
     if session.get('delivery_option') == 'delivery' and session.get('address_id'):
         order.address_id = session.get('address_id')
-    
+
     db.session.add(order)
-    db.session.flush()  # Get the order ID without committing
-    
-    # Add order items and update stock
-    total = 0
+    try:
+        # Claims the key; a concurrent replay blocks here until the first
+        # transaction finishes, then fails on the unique index
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        existing = find_order(key, current_user.id)
+        if existing is None:
+            raise
+        return existing, False
+
+    # Resolve every line first: if any product is gone or short, the whole
+    # order fails rather than quietly leaving lines out
+    cart_lines = []
     for cart_key, cart_item in cart.items():
         # Extract product_id from cart_key or use the product_id from cart_item
         if isinstance(cart_item, dict) and 'product_id' in cart_item:
@@ -682,200 +930,269 @@ def payment_success():
             else:
                 product_id = cart_key
             quantity = cart_item
-            
-        product = Product.query.get(int(product_id))
-        if product and product.stock >= quantity:
-            order_item = OrderItem(
-                order_id=order.id,
-                product_id=product.id,
-                quantity=quantity,
-                price=product.price
-            )
-            db.session.add(order_item)
-            
-            # Update stock
-            product.stock -= quantity
-            
-            total += product.price * quantity
-    
+
+        cart_lines.append((int(product_id), quantity, cart_item))
+
+    products = {p.id: p for p in Product.query.filter(Product.id.in_({line[0] for line in cart_lines}))}
+    wanted = {}
+    for product_id, quantity, _ in cart_lines:
+        wanted[product_id] = wanted.get(product_id, 0) + quantity
+    # Holds of other live checkouts still count even if this one's expired;
+    # the flush above holds the write lock, so they can't change meanwhile
+    held = reservations.held_by_others(key, list(wanted))
+    for product_id, quantity in wanted.items():
+        product = products.get(product_id)
+        if product is None:
+            db.session.rollback()
+            raise CheckoutError('An item in your cart is no longer available')
+        available = product.stock - held.get(product_id, 0)
+        if quantity > available:
+            db.session.rollback()
+            raise InsufficientStock(product, max(available, 0))
+
+    # Add order items and update stock
+    total = 0
+    lines = []
+    customized = False
+    for product_id, quantity, cart_item in cart_lines:
+        product = products[product_id]
+        order_item = OrderItem(
+            order_id=order.id,
+            product_id=product.id,
+            quantity=quantity,
+            price=product.price
+        )
+        db.session.add(order_item)
+        if isinstance(cart_item, dict) and cart_item.get('customization'):
+            add_customization(order_item, cart_item['customization'])
+
+        # Update stock
+        product.stock -= quantity
+
+        total += product.price * quantity
+        lines.append((product.name, quantity))
+        customized = customized or (isinstance(cart_item, dict) and bool(cart_item.get('customization')))
+
     order.total_amount = total
+    summarize(order, lines, customized)
+    record_order(order, wanted)
+    publish_order_created(order)
+    # The order now owns the stock its checkout was holding
+    reservations.release(key)
     db.session.commit()
-    
-    # Clear cart
-    session.pop('cart', None)
-    
-    flash('Payment successful! Your order has been placed.', 'success')
-    return redirect(url_for('order_confirmation', order_id=order.id))
+    return order, True
+
+# Records the size, container and toppings chosen for an order line
+def add_customization(order_item, customization):
+    topping_ids = customization.get('topping_ids') or []
+    db.session.add(Customization(
+        order_item=order_item,
+        size=customization.get('size') or 'small',
+        container=customization.get('container') or 'cone',
+        extra_notes=customization.get('extra_notes'),
+        toppings=Topping.query.filter(Topping.id.in_(topping_ids)).all() if topping_ids else []
+    ))
+
+# Compact summary of a new order for the live order board; committed
+# together with the order
+def publish_order_created(order):
+    db.session.flush()
+    order_events.publish(
+        order.id,
+        'created',
+        status=order.status,
+        total_amount=order.total_amount,
+        customer=current_user.username,
+        item_count=order.item_count,
+        item_preview=order.item_preview,
+        created_at=order.created_at.isoformat(),
+        updated_at=order.updated_at.isoformat()
+    )
+
+ORDER_STATUSES = ['pending', 'processing', 'preparing', 'ready', 'delivered', 'cancelled']
+MAX_BULK_ORDERS = 200
+PROFILE_RECENT_ORDERS = 5
+
+# Statuses after which an order no longer changes, so its page stops
+# listening
+FINAL_ORDER_STATUSES = ('delivered', 'cancelled')
 
-@app.route('/payment/cancel')
+def order_status_cursor(order):
+    if order.status in FINAL_ORDER_STATUSES:
+        return None
+    return order_events.cursor()
+
+def sse_response(subscription):
+    return Response(event_stream(subscription), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@bp.route('/payment/cancel')
 @login_required
 def payment_cancel():
+    if valid_key(session.get('checkout_key')):
+        reservations.release(session['checkout_key'])
+        db.session.commit()
     flash('Payment was cancelled.', 'info')
-    return redirect(url_for('cart'))
+    return redirect(url_for('main.cart'))
 
-@app.route('/place-order', methods=['POST'])
+@bp.route('/place-order', methods=['POST'])
 @login_required
 def place_order():
+    # A retried post carries the same session, and with it the checkout key
+    order = find_order(session.get('checkout_key'), current_user.id)
+    if order:
+        return redirect(url_for('main.order_confirmation', order_id=order.id))
+
     cart = session.get('cart', {})
     if not cart:
         flash('Your cart is empty', 'warning')
-        return redirect(url_for('index'))
-    
-    # Create order
-    order = Order(
-        user_id=current_user.id,
-        status='pending',
-        total_amount=0
-    )
-    
-    # Add delivery address if delivery option was selected
-    if session.get('delivery_option') == 'delivery' and session.get('address_id'):
-        order.address_id = session.get('address_id')
-    
-    db.session.add(order)
-    
-    # Add order items and update stock
-    total = 0
-    for cart_key, cart_item in cart.items():
-        # Extract product_id from cart_key or use the product_id from cart_item
-        if isinstance(cart_item, dict) and 'product_id' in cart_item:
-            # If cart_item has product_id field, use it
-            product_id = cart_item['product_id']
-            quantity = cart_item['quantity']
-        else:
-            # If cart_key is in format "product_id_customization_json"
-            if '_' in str(cart_key):
-                product_id = cart_key.split('_')[0]
-            else:
-                product_id = cart_key
-            quantity = cart_item
-            
-        product = Product.query.get(int(product_id))
-        if product and product.stock >= quantity:
-            order_item = OrderItem(
-                order_id=order.id,
-                product_id=product.id,
-                quantity=quantity,
-                price=product.price
-            )
-            db.session.add(order_item)
-            
-            # Update stock
-            product.stock -= quantity
-            
-            total += product.price * quantity
-    
-    order.total_amount = total
-    db.session.commit()
-    
+        return redirect(url_for('main.index'))
+
+    try:
+        order, created = place_cart_order(cart, 'pending')
+    except CheckoutError as e:
+        flash(f'{e}. Please update your cart.', 'warning')
+        return redirect(url_for('main.cart'))
+
     # Clear cart
     session.pop('cart', None)
-    
-    flash('Order placed successfully!', 'success')
-    return redirect(url_for('order_confirmation', order_id=order.id))
+    session.pop('checkout_key', None)
+
+    if created:
+        flash('Order placed successfully!', 'success')
+    return redirect(url_for('main.order_confirmation', order_id=order.id))
 
-@app.route('/order-confirmation/<int:order_id>')
+@bp.route('/order-confirmation/<int:order_id>')
 @login_required
 def order_confirmation(order_id):
     order = Order.query.get_or_404(order_id)
     if order.user_id != current_user.id:
         flash('Access denied', 'danger')
-        return redirect(url_for('index'))
-    return render_template('order_confirmation.html', order=order)
-
-# New models for customization
-class Topping(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    price = db.Column(db.Float, nullable=False)
-    image_url = db.Column(db.String(200))
-    description = db.Column(db.Text)
-
-class Customization(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    order_item_id = db.Column(db.Integer, db.ForeignKey('order_item.id'), nullable=False)
-    size = db.Column(db.String(20), nullable=False)  # small, medium, large
-    container = db.Column(db.String(20), nullable=False)  # cone, cup
-    toppings = db.relationship('Topping', secondary='customization_toppings')
-    extra_notes = db.Column(db.Text)
-
-# Association table for customization toppings
-customization_toppings = db.Table('customization_toppings',
-    db.Column('customization_id', db.Integer, db.ForeignKey('customization.id'), primary_key=True),
-    db.Column('topping_id', db.Integer, db.ForeignKey('topping.id'), primary_key=True)
-)
+        return redirect(url_for('main.index'))
+    return render_template('order_confirmation.html', order=order, status_cursor=order_status_cursor(order),
+                           eta=order_eta(order))
 
 # New routes for customization
-@app.route('/customize/<int:product_id>')
+@bp.route('/customize/<int:product_id>')
 @login_required
 def customize_ice_cream(product_id):
     product = Product.query.get_or_404(product_id)
     toppings = Topping.query.all()
-    return render_template('customize.html', product=product, toppings=toppings)
+    return render_template('customize.html', product=product, toppings=toppings,
+                           size_prices=pricing.table().sizes,
+                           popular_topping_ids=recommendations.for_product(product.id, 'topping'))
 
-@app.route('/api/customize/add', methods=['POST'])
+@bp.route('/api/customize/add', methods=['POST'])
 @login_required
 def add_customized_item():
-    data = request.get_json()
-    product_id = data.get('product_id')
-    size = data.get('size')
-    container = data.get('container')
-    topping_ids = data.get('toppings', [])
-    extra_notes = data.get('extra_notes', '')
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'Expected a JSON object'}), 400
+    error = customization_error(data.get('size'), data.get('container'), data.get('toppings'))
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+    product = Product.query.get_or_404(data.get('product_id'))
 
-    # Calculate total price
-    product = Product.query.get_or_404(product_id)
-    base_price = product.price
-    
-    # Add size price
-    size_prices = {
-        'small': 0,
-        'medium': 20,
-        'large': 40
-    }
-    total_price = base_price + size_prices.get(size, 0)
-    
-    # Add toppings price
-    toppings = Topping.query.filter(Topping.id.in_(topping_ids)).all()
-    for topping in toppings:
-        total_price += topping.price
-
-    # Create order item
-    order_item = OrderItem(
-        product_id=product_id,
-        quantity=1,
-        price=total_price,
-        customization=Customization(
-            size=size,
-            container=container,
-            toppings=toppings,
-            extra_notes=extra_notes
-        )
+    # Add to cart
+    cart_key, cart_item = new_cart_line(
+        product,
+        1,
+        size=data.get('size'),
+        container=data.get('container'),
+        topping_ids=data.get('toppings', []),
+        extra_notes=data.get('extra_notes', '')
     )
+    cart = session.get('cart', {})
+    if cart_key in cart:
+        cart[cart_key]['quantity'] += 1
+    else:
+        cart[cart_key] = cart_item
+    session['cart'] = cart
 
-    # Add to cart
-    if 'cart' not in session:
-        session['cart'] = []
-    session['cart'].append({
-        'product_id': product_id,
-        'quantity': 1,
-        'price': total_price,
-        'customization': {
-            'size': size,
-            'container': container,
-            'topping_ids': topping_ids,
-            'extra_notes': extra_notes
-        }
+    return jsonify({
+        'status': 'success',
+        'message': 'Customized item added to cart',
+        'total_price': cart_item['price']
     })
-    session.modified = True
 
+# Current price table, so clients can price configurations locally and
+# re-fetch only when the version changes
+@bp.route('/api/pricing')
+def get_pricing():
+    return jsonify(pricing.table().as_dict())
+
+# Price many candidate configurations in one call from the in-memory table
+MAX_QUOTES = 200
+
+@bp.route('/api/pricing/quote', methods=['POST'])
+@csrf.exempt
+def quote_prices():
+    data = request.get_json(silent=True) or {}
+    configurations = data.get('configurations')
+    if not isinstance(configurations, list) or len(configurations) > MAX_QUOTES:
+        return jsonify({
+            'status': 'error',
+            'message': f'configurations must be a list of at most {MAX_QUOTES} items'
+        }), 400
+
+    for index, config in enumerate(configurations):
+        error = customization_error(config.get('size'), config.get('container'), config.get('toppings')) \
+            if isinstance(config, dict) else 'Each configuration must be an object'
+        if error:
+            return jsonify({
+                'status': 'error',
+                'message': error,
+                'configuration': index
+            }), 400
+
+    table = pricing.table()
+    quotes = []
+    for config in configurations:
+        price = table.quote(
+            config.get('product_id'),
+            size=config.get('size'),
+            container=config.get('container'),
+            topping_ids=config.get('toppings')
+        )
+        quotes.append({'price': price} if price is not None else {'error': 'Product not found'})
+    return jsonify({
+        'version': table.version,
+        'quotes': quotes
+    })
+
+# In-stock products from a recommendation list, in its order
+def recommended_products(product_ids):
+    if not product_ids:
+        return []
+    products = {product.id: product for product in
+                Product.query.filter(Product.id.in_(product_ids), Product.stock > 0)}
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+# Precomputed "frequently bought together" products and popular toppings
+@bp.route('/api/recommendations/<int:product_id>')
+@read_replica
+def get_recommendations(product_id):
+    topping_ids = recommendations.for_product(product_id, 'topping')
+    toppings = {topping.id: topping for topping in Topping.query.filter(Topping.id.in_(topping_ids))} if topping_ids else {}
     return jsonify({
         'status': 'success',
-        'message': 'Customized item added to cart',
-        'total_price': total_price
+        'products': [{
+            'id': p.id,
+            'name': p.name,
+            'price': p.price,
+            'image_url': p.image_url
+        } for p in recommended_products(recommendations.for_product(product_id))],
+        'toppings': [{
+            'id': toppings[topping_id].id,
+            'name': toppings[topping_id].name,
+            'price': toppings[topping_id].price
+        } for topping_id in topping_ids if topping_id in toppings]
     })
 
-@app.route('/api/toppings')
+@bp.route('/api/toppings')
+@read_replica
 def get_toppings():
     toppings = Topping.query.all()
     return jsonify([{
@@ -887,21 +1204,21 @@ def get_toppings():
     } for t in toppings])
 
 # Admin routes for managing toppings
-@app.route('/admin/toppings')
+@bp.route('/admin/toppings')
 @login_required
 def manage_toppings():
     if not current_user.is_admin:
         flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     toppings = Topping.query.all()
     return render_template('admin/toppings.html', toppings=toppings)
 
-@app.route('/admin/topping/add', methods=['GET', 'POST'])
+@bp.route('/admin/topping/add', methods=['GET', 'POST'])
 @login_required
 def add_topping():
     if not current_user.is_admin:
         flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     if request.method == 'POST':
         name = request.form.get('name')
@@ -913,7 +1230,7 @@ def add_topping():
         image_url = None
         if image:
             filename = secure_filename(image.filename)
-            image.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            image.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
             image_url = f'/static/uploads/{filename}'
         
         topping = Topping(
@@ -924,17 +1241,18 @@ def add_topping():
         )
         db.session.add(topping)
         db.session.commit()
+        pricing.invalidate()
         flash('Topping added successfully!', 'success')
-        return redirect(url_for('manage_toppings'))
+        return redirect(url_for('main.manage_toppings'))
     
     return render_template('admin/add_topping.html')
 
-@app.route('/admin/topping/edit/<int:id>', methods=['GET', 'POST'])
+@bp.route('/admin/topping/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit_topping(id):
     if not current_user.is_admin:
         flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     topping = Topping.query.get_or_404(id)
     
@@ -948,21 +1266,22 @@ def edit_topping(id):
         if image:
             # Delete old image if exists
             if topping.image_url and topping.image_url.startswith('/static/uploads/'):
-                old_image_path = os.path.join(app.root_path, topping.image_url.lstrip('/'))
+                old_image_path = os.path.join(current_app.root_path, topping.image_url.lstrip('/'))
                 if os.path.exists(old_image_path):
                     os.remove(old_image_path)
             
             filename = secure_filename(image.filename)
-            image.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            image.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
             topping.image_url = f'/static/uploads/{filename}'
         
         db.session.commit()
+        pricing.invalidate()
         flash('Topping updated successfully!', 'success')
-        return redirect(url_for('manage_toppings'))
+        return redirect(url_for('main.manage_toppings'))
     
     return render_template('admin/edit_topping.html', topping=topping)
 
-@app.route('/admin/topping/delete/<int:id>', methods=['POST'])
+@bp.route('/admin/topping/delete/<int:id>', methods=['POST'])
 @login_required
 def delete_topping(id):
     if not current_user.is_admin:
@@ -972,34 +1291,96 @@ def delete_topping(id):
     
     # Delete image if exists
     if topping.image_url and topping.image_url.startswith('/static/uploads/'):
-        image_path = os.path.join(app.root_path, topping.image_url.lstrip('/'))
+        image_path = os.path.join(current_app.root_path, topping.image_url.lstrip('/'))
         if os.path.exists(image_path):
             os.remove(image_path)
     
     db.session.delete(topping)
     db.session.commit()
+    pricing.invalidate()
     
     return jsonify({'status': 'success', 'message': 'Topping deleted successfully'})
 
-@app.route('/orders')
+@bp.route('/orders')
 @login_required
+@read_replica
 def my_orders():
     orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
+    # Older finished orders live in the archive
+    orders += ArchivedOrder.query.filter_by(user_id=current_user.id).order_by(ArchivedOrder.created_at.desc()).all()
     return render_template('orders.html', orders=orders)
 
-@app.route('/order/<int:order_id>')
+@bp.route('/order/<int:order_id>')
 @login_required
 def order_details(order_id):
-    order = Order.query.get_or_404(order_id)
+    order = get_order(order_id) or abort(404)
     if order.user_id != current_user.id:
         flash('Access denied', 'danger')
-        return redirect(url_for('my_orders'))
-    return render_template('order_details.html', order=order)
+        return redirect(url_for('main.my_orders'))
+    return render_template('order_details.html', order=order, status_cursor=order_status_cursor(order),
+                           eta=order_eta(order))
+
+# Estimated ready time of an order still in the kitchen queue, or None
+def order_eta(order):
+    return kitchen_queue.eta(order.id) if order.status in QUEUED_STATUSES else None
+
+# Current kitchen estimate for a customer's own order, polled by the order
+# pages while it is being made
+@bp.route('/order/<int:order_id>/eta')
+@login_required
+def order_eta_api(order_id):
+    row = db.session.query(Order.user_id, Order.status).filter_by(id=order_id).first()
+    if row is None:
+        return jsonify({'status': 'error', 'message': 'Order not found'}), 404
+    if row.user_id != current_user.id:
+        return jsonify({'status': 'error', 'message': 'Access denied'}), 403
+    eta = kitchen_queue.eta(order_id) if row.status in QUEUED_STATUSES else None
+    return jsonify({
+        'status': 'success',
+        'order_status': row.status,
+        'eta': eta and {
+            'position': eta['position'],
+            'minutes': eta['minutes'],
+            'ready_at': eta['eta'].isoformat()
+        }
+    })
 
-@app.route('/admin/orders')
+# Status changes of a customer's own order, by long-poll. The page passes
+# the cursor it was rendered with and then the one each answer returns, so a
+# change made between two polls is replayed instead of lost. A request holds
+# its thread for at most ORDER_STATUS_POLL_WAIT seconds; when too many are
+# already waiting it answers at once and the page polls again after `retry`.
+@bp.route('/order/<int:order_id>/events')
+@login_required
+def order_status_events(order_id):
+    owner_id = db.session.query(Order.user_id).filter_by(id=order_id).scalar()
+    if owner_id is None:
+        return jsonify({'status': 'error', 'message': 'Order not found'}), 404
+    if owner_id != current_user.id:
+        return jsonify({'status': 'error', 'message': 'Access denied'}), 403
+    after = request.args.get('after', type=int)
+    if after is None:
+        after = order_events.cursor()
+    events, reset, waited = order_events.wait_for(order_id, after, current_app.config['ORDER_STATUS_POLL_WAIT'])
+    return jsonify({
+        'status': 'success',
+        'events': events,
+        'cursor': events[-1]['id'] if events else after,
+        'reset': reset,
+        # Poll again straight away after a full wait, otherwise back off
+        'retry': 0 if waited or events else current_app.config['ORDER_STATUS_POLL_INTERVAL']
+    })
+
+# Rendered from the primary: the stream only replays events after the
+# cursor, so the board must already hold every order up to it, which a
+# lagging replica can't promise
+@bp.route('/admin/orders')
 @login_required
 @admin_required
 def admin_orders():
+    # Taken before the query so the stream replays anything committed after
+    cursor = order_events.cursor()
+
     # Get filter parameters
     status = request.args.get('status')
     date_from = request.args.get('date_from')
@@ -1018,138 +1399,211 @@ def admin_orders():
     if date_to:
         query = query.filter(Order.created_at <= datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1))
     
-    # Get orders
-    orders = query.order_by(Order.created_at.desc()).all()
+    # Get orders. Items are summarized on the order row; customers and
+    # addresses come in one IN query each rather than one per row
+    orders = query.options(selectinload(Order.user), selectinload(Order.address)) \
+        .order_by(Order.created_at.desc()).all()
     
     # Get current time for time-in-status calculations
     now = datetime.utcnow()
     
-    return render_template('admin/orders.html', orders=orders, now=now)
+    return render_template('admin/orders.html', orders=orders, now=now, etas=kitchen_queue.schedule(now),
+                           cursor=cursor)
 
-@app.route('/admin/order/<int:order_id>')
+# Kitchen queue estimates for the live order board
+@bp.route('/admin/kitchen/queue')
+@login_required
+@admin_required
+def admin_kitchen_queue():
+    return jsonify({
+        order_id: {
+            'position': eta['position'],
+            'minutes': eta['minutes'],
+            'late': eta['late']
+        } for order_id, eta in kitchen_queue.schedule().items()
+    })
+
+@bp.route('/admin/metrics')
+@login_required
+@admin_required
+def admin_metrics():
+    return jsonify({
+        'user_cache': user_cache.stats(),
+        'auth_rate_limit': auth_limiter.stats(),
+        'password_hasher': password_hasher.stats(),
+        'fragment_cache': fragment_cache.stats(),
+        'order_events': order_events.stats(),
+        'reservations': reservations.stats(),
+        'replica': replica_router.stats(),
+        'recommendations': recommendations.stats(),
+        'dispatch': dispatch_board.stats(),
+        'kitchen': kitchen_queue.stats()
+    })
+
+# Restock recommendations from the demand forecast
+@bp.route('/admin/forecast')
+@login_required
+@admin_required
+@read_replica
+def admin_forecast():
+    # The forecast needs numpy, a heavy import only this report uses
+    from forecast import restock_report
+    rows, history_start = restock_report(current_app.config)
+    return render_template('admin/forecast.html', rows=rows, history_start=history_start,
+                           weekdays=['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
+                           window=current_app.config['FORECAST_WINDOW_DAYS'],
+                           cover_days=current_app.config['FORECAST_COVER_DAYS'],
+                           lead_time=current_app.config['FORECAST_LEAD_TIME_DAYS'],
+                           horizon=current_app.config['FORECAST_HORIZON_DAYS'])
+
+# Bulk create and update of products from a CSV or NDJSON upload. The
+# dry-run box is ticked by default, so the first upload only shows the diff.
+@bp.route('/admin/products/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_products_view():
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV or NDJSON file to import.', 'danger')
+            return redirect(url_for('main.import_products_view'))
+        try:
+            rows = read_rows(upload.stream, upload.filename)
+        except ProductImportError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('main.import_products_view'))
+        report = import_products(
+            rows,
+            dry_run=bool(request.form.get('dry_run')),
+            workers=current_app.config['PRODUCT_IMPORT_WORKERS'],
+            timeout=current_app.config['PRODUCT_IMPORT_TIMEOUT'],
+            max_bytes=current_app.config['MAX_CONTENT_LENGTH']
+        )
+        if report['applied']:
+            pricing.invalidate()
+            flash(f"Imported {report['counts']['create']} new and {report['counts']['update']} updated products.",
+                  'success')
+        elif report['counts']['error']:
+            flash('Nothing was imported; fix the rows marked below and upload the file again.', 'danger')
+    return render_template('admin/import_products.html', report=report, categories=PRODUCT_CATEGORIES)
+
+# Server-Sent Events feed for the live order board. Events come from the
+# in-process hub, so connected screens cost no database queries.
+@bp.route('/admin/orders/stream')
+@login_required
+@admin_required
+def admin_orders_stream():
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is None:
+        last_event_id = request.args.get('after', type=int)
+    return sse_response(order_events.subscribe(last_event_id=last_event_id))
+
+@bp.route('/admin/order/<int:order_id>')
 @login_required
 @admin_required
 def admin_order_details(order_id):
-    order = Order.query.get_or_404(order_id)
+    order = get_order(order_id) or abort(404)
     return render_template('admin/order_details.html', order=order)
 
-@app.route('/admin/order/update-status/<int:order_id>', methods=['POST'])
+@bp.route('/admin/order/update-status/<int:order_id>', methods=['POST'])
 @login_required
 @admin_required
 def update_order_status(order_id):
     order = Order.query.get_or_404(order_id)
     new_status = request.form.get('status')
-    if new_status in ['pending', 'processing', 'preparing', 'ready', 'delivered', 'cancelled']:
+    if new_status in ORDER_STATUSES:
+        record_status_change(order.id, order.user_id, order.total_amount, order.status, new_status)
         order.status = new_status
         order.updated_at = datetime.utcnow()
+        order_events.publish(order.id, 'status', status=new_status, updated_at=order.updated_at.isoformat())
         db.session.commit()
+        if new_status != 'ready':
+            dispatch_board.discard([order.id])
+        if new_status not in QUEUED_STATUSES:
+            kitchen_queue.discard([order.id])
         flash('Order status updated successfully!', 'success')
-    return redirect(url_for('admin_order_details', order_id=order_id))
-
-def create_sample_products():
-    if Product.query.count() == 0:
-        sample_products = [
-            Product(
-                name='Vanilla Delight',
-                description='Classic vanilla ice cream made with Madagascar vanilla beans',
-                price=99.99,
-                category='classic',
-                stock=50,
-                image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb?ixlib=rb-1.2.1&auto=format&fit=crop&w=500&q=60'
-            ),
-            Product(
-                name='Chocolate Dream',
-                description='Rich and creamy chocolate ice cream with Belgian chocolate',
-                price=129.99,
-                category='premium',
-                stock=40,
-                image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb?ixlib=rb-1.2.1&auto=format&fit=crop&w=500&q=60'
-            ),
-            Product(
-                name='Strawberry Sorbet',
-                description='Refreshing strawberry sorbet made with fresh strawberries',
-                price=119.99,
-                category='sorbet',
-                stock=30,
-                image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb?ixlib=rb-1.2.1&auto=format&fit=crop&w=500&q=60'
-            ),
-            Product(
-                name='Mango Tango',
-                description='Tropical mango ice cream with real mango pieces',
-                price=139.99,
-                category='premium',
-                stock=35,
-                image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb?ixlib=rb-1.2.1&auto=format&fit=crop&w=500&q=60'
-            ),
-            Product(
-                name='Vegan Coconut',
-                description='Creamy coconut ice cream made with coconut milk',
-                price=149.99,
-                category='vegan',
-                stock=25,
-                image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb?ixlib=rb-1.2.1&auto=format&fit=crop&w=500&q=60'
-            )
-        ]
-        for product in sample_products:
-            db.session.add(product)
-        db.session.commit()
+    return redirect(url_for('main.admin_order_details', order_id=order_id))
 
-def create_admin_user():
-    if not User.query.filter_by(email='admin@example.com').first():
-        admin = User(
-            username='admin',
-            email='admin@example.com',
-            is_admin=True
-        )
-        admin.set_password('admin123')
-        db.session.add(admin)
-        db.session.commit()
+# Marks many orders with one status in a single UPDATE ... WHERE id IN (...)
+# and one commit, for the kitchen clearing a rush at once
+@bp.route('/admin/orders/bulk-status', methods=['POST'])
+@login_required
+@admin_required
+def bulk_update_order_status():
+    new_status = request.form.get('status')
+    try:
+        order_ids = sorted({int(order_id) for order_id in request.form.getlist('order_ids')})
+    except ValueError:
+        order_ids = []
+
+    if new_status not in ORDER_STATUSES or not order_ids:
+        flash('Select at least one order and a valid status.', 'danger')
+    elif len(order_ids) > MAX_BULK_ORDERS:
+        flash(f'You can update at most {MAX_BULK_ORDERS} orders at once.', 'danger')
+    else:
+        # Only orders that exist and actually change are updated and announced
+        rows = db.session.query(Order.id, Order.user_id, Order.total_amount, Order.status).filter(
+            Order.id.in_(order_ids), Order.status != new_status
+        ).all()
+        changed = [row.id for row in rows]
+        if changed:
+            now = datetime.utcnow()
+            Order.query.filter(Order.id.in_(changed)).update(
+                {'status': new_status, 'updated_at': now}, synchronize_session=False
+            )
+            record_status_changes(rows, new_status)
+            order_events.publish_many(changed, 'status', status=new_status, updated_at=now.isoformat())
+            db.session.commit()
+            if new_status != 'ready':
+                dispatch_board.discard(changed)
+            if new_status not in QUEUED_STATUSES:
+                kitchen_queue.discard(changed)
+        flash(f'{len(changed)} order(s) marked as {new_status}.', 'success')
+    if request.form.get('return_to') == 'dispatch':
+        return redirect(url_for('main.admin_dispatch'))
+    return redirect(url_for('main.admin_orders', status=request.form.get('return_status') or None))
+
+# Ready delivery orders grouped into rider batches by area and ready time
+@bp.route('/admin/dispatch')
+@login_required
+@admin_required
+def admin_dispatch():
+    now = datetime.utcnow()
+    return render_template('admin/dispatch.html', batches=dispatch_board.batches(now), now=now,
+                           window=dispatch_board.window, capacity=dispatch_board.capacity)
 
-@app.route('/profile')
+@bp.route('/profile')
 @login_required
 def profile():
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
-    return render_template('user_profile.html', orders=orders)
-
-@app.route('/profile/edit', methods=['GET', 'POST'])
+    # Totals come from the customer's stats row and only the latest orders
+    # are listed, so the page costs the same however long the history is
+    stats = db.session.get(UserStats, current_user.id)
+    orders = Order.query.filter_by(user_id=current_user.id) \
+        .order_by(Order.created_at.desc()).limit(PROFILE_RECENT_ORDERS).all()
+    return render_template('user_profile.html', stats=stats, orders=orders)
+
+@bp.route('/profile/edit', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
     form = EditProfileForm()
     if form.validate_on_submit():
-        current_user.username = form.username.data
-        current_user.email = form.email.data
+        if form.password.data and auth_rate_limited(current_user.email):
+            return render_template('edit_profile.html', form=form), 429
+        # current_user is a cached snapshot, so update the real row
+        user = db.session.get(User, current_user.id)
+        user.username = form.username.data
+        user.email = form.email.data
         if form.password.data:
-            current_user.set_password(form.password.data)
+            user.set_password(form.password.data)
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash('Your profile has been updated.', 'success')
-        return redirect(url_for('profile'))
+        return redirect(url_for('main.profile'))
     elif request.method == 'GET':
         form.username.data = current_user.username
         form.email.data = current_user.email
     return render_template('edit_profile.html', form=form)
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        # Create admin user if it doesn't exist
-        create_admin_user()
-        # Add sample products if none exist
-        if Product.query.count() == 0:
-            sample_products = [
-                Product(
-                    name='Vanilla Delight',
-                    description='Classic vanilla ice cream made with Madagascar vanilla beans',
-                    price=99.99,
-                    image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb'
-                ),
-                Product(
-                    name='Chocolate Dream',
-                    description='Rich chocolate ice cream',
-                    price=129.99,
-                    image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb'
-                )
-            ]
-            for product in sample_products:
-                db.session.add(product)
-            db.session.commit()
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, text
+from models import (db, Order, OrderItem, Customization, customization_toppings, ArchivedOrder,
+                    ArchivedOrderItem, ArchivedCustomization, archived_customization_toppings)
+
+# Hot/cold split for orders. Delivered and cancelled orders that haven't
+# changed for a while are moved, with their items and customizations, into
+# the archived_* tables, so the admin board, its filters and checkout work on
+# a table holding only recent and in-flight orders. Detail pages fall back to
+# the archive, so moved orders stay reachable at the same URLs.
+ARCHIVE_STATUSES = ('delivered', 'cancelled')
+
+# Indexes the archiver and the hot tables rely on, for databases created
+# before they existed
+ARCHIVE_INDEX_DDL = [
+    'CREATE INDEX IF NOT EXISTS ix_order_status_updated ON "order" (status, updated_at)',
+    'CREATE INDEX IF NOT EXISTS ix_order_item_order_id ON order_item (order_id)',
+]
+
+def create_archive_indexes():
+    for statement in ARCHIVE_INDEX_DDL:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+def _copy(source, target, where):
+    columns = [column.name for column in source.columns]
+    db.session.execute(target.insert().from_select(
+        columns, select(*[source.c[name] for name in columns]).where(where)
+    ))
+
+# Customizations of items archived before customizations were archived with
+# them, moved after the fact; run by `flask init-db` on upgrade
+def archive_stranded_customizations():
+    stranded = Customization.order_item_id.in_(select(ArchivedOrderItem.id)) & \
+        Customization.order_item_id.not_in(select(OrderItem.id))
+    customization_ids = select(Customization.id).where(stranded)
+    _copy(Customization.__table__, ArchivedCustomization.__table__, stranded)
+    _copy(customization_toppings, archived_customization_toppings,
+          customization_toppings.c.customization_id.in_(customization_ids))
+    db.session.execute(customization_toppings.delete().where(
+        customization_toppings.c.customization_id.in_(customization_ids)))
+    Customization.query.filter(stranded).delete(synchronize_session=False)
+    db.session.commit()
+
+# Moves finished orders last changed more than older_than days ago, one
+# batch per transaction so the write lock is only held briefly. Returns the
+# number of orders moved.
+def archive_orders(older_than, batch_size=500):
+    cutoff = datetime.utcnow() - timedelta(days=older_than)
+    # The newest order always stays hot: SQLite hands out max(id) + 1, so
+    # archiving it would let a new order reuse an archived id
+    newest_id = db.session.query(func.max(Order.id)).scalar()
+    moved = 0
+    while newest_id is not None:
+        order_ids = [order_id for (order_id,) in db.session.query(Order.id).filter(
+            Order.status.in_(ARCHIVE_STATUSES),
+            Order.updated_at < cutoff,
+            Order.id < newest_id
+        ).limit(batch_size)]
+        if not order_ids:
+            break
+        item_ids = select(OrderItem.id).where(OrderItem.order_id.in_(order_ids))
+        customization_ids = select(Customization.id).where(Customization.order_item_id.in_(item_ids))
+        _copy(Order.__table__, ArchivedOrder.__table__, Order.id.in_(order_ids))
+        _copy(OrderItem.__table__, ArchivedOrderItem.__table__, OrderItem.order_id.in_(order_ids))
+        _copy(Customization.__table__, ArchivedCustomization.__table__, Customization.order_item_id.in_(item_ids))
+        _copy(customization_toppings, archived_customization_toppings,
+              customization_toppings.c.customization_id.in_(customization_ids))
+        db.session.execute(customization_toppings.delete().where(
+            customization_toppings.c.customization_id.in_(customization_ids)))
+        Customization.query.filter(Customization.order_item_id.in_(item_ids)).delete(synchronize_session=False)
+        OrderItem.query.filter(OrderItem.order_id.in_(order_ids)).delete(synchronize_session=False)
+        Order.query.filter(Order.id.in_(order_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        moved += len(order_ids)
+    return moved
+
+# An order by id from the hot table or, failing that, the archive
+def get_order(order_id):
+    return db.session.get(Order, order_id) or db.session.get(ArchivedOrder, order_id)
@@ -0,0 +1,62 @@
+import json
+from models import db, Product
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Public field name -> column. Only the requested columns are selected, so a
+# kiosk asking for id,name,price,stock never reads the long descriptions.
+CATALOG_FIELDS = {
+    'id': Product.id,
+    'name': Product.name,
+    'description': Product.description,
+    'price': Product.price,
+    'image': Product.image_url,
+    'category': Product.category,
+    'stock': Product.stock
+}
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+def parse_fields(value):
+    if not value:
+        return list(CATALOG_FIELDS)
+    fields = []
+    for name in value.split(','):
+        name = name.strip()
+        # Tolerate stray commas such as a trailing one
+        if not name:
+            continue
+        if name not in CATALOG_FIELDS:
+            raise ValueError(f'Unknown field: {name}')
+        if name not in fields:
+            fields.append(name)
+    return fields or list(CATALOG_FIELDS)
+
+# Keyset pagination on the primary key: each page is an index range scan
+# starting after the last id the client saw, whatever page it is on
+def list_products(fields, category=None, after=None, limit=DEFAULT_LIMIT):
+    limit = min(max(limit, 1), MAX_LIMIT)
+    # id leads every row because it is the pagination cursor
+    query = db.session.query(Product.id, *[CATALOG_FIELDS[name] for name in fields])
+    if category:
+        query = query.filter(Product.category == category)
+    if after is not None:
+        query = query.filter(Product.id > after)
+    rows = query.order_by(Product.id).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [dict(zip(fields, row[1:])) for row in rows]
+    return {
+        'items': items,
+        'next_cursor': rows[-1][0] if has_more else None
+    }
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
@@ -8,7 +8,91 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///ice_cream.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Optional read replica for read-only views, e.g. sqlite:///replica.db kept
+    # up to date by `flask replicate`
+    SQLALCHEMY_BINDS = {'replica': os.environ['REPLICA_DATABASE_URL']} if os.environ.get('REPLICA_DATABASE_URL') else {}
+    # How long a browser keeps reading from the primary after it wrote
+    REPLICA_READ_YOUR_WRITES = int(os.environ.get('REPLICA_READ_YOUR_WRITES', 15))  # seconds
+    REPLICA_SNAPSHOT_INTERVAL = float(os.environ.get('REPLICA_SNAPSHOT_INTERVAL', 5))  # seconds
     UPLOAD_FOLDER = 'static/uploads'
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    # Per-process cache used by the Flask-Login user loader
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))  # seconds
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    # Login/register throttling: burst size and tokens refilled per minute
+    AUTH_RATE_LIMIT_IP_BURST = int(os.environ.get('AUTH_RATE_LIMIT_IP_BURST', 20))
+    AUTH_RATE_LIMIT_IP_PER_MINUTE = int(os.environ.get('AUTH_RATE_LIMIT_IP_PER_MINUTE', 10))
+    AUTH_RATE_LIMIT_ACCOUNT_BURST = int(os.environ.get('AUTH_RATE_LIMIT_ACCOUNT_BURST', 5))
+    AUTH_RATE_LIMIT_ACCOUNT_PER_MINUTE = int(os.environ.get('AUTH_RATE_LIMIT_ACCOUNT_PER_MINUTE', 3))
+    # Bounded pool for password hashing so it cannot occupy every request thread
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    # Running plus waiting hashes; kept below the request threads per worker
+    # (WEB_THREADS) so at least one thread is always free for other pages
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING',
+                                                   max(1, int(os.environ.get('WEB_THREADS', 4)) - 1)))
+    # Memory cap for rendered storefront fragments, per worker process
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+    LANGUAGES = ['en']
+    # Shared Jinja bytecode cache; defaults to instance/jinja_cache
+    JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR')
+    # Live order events: how often each worker polls the event log, and how
+    # long events are kept for reconnecting clients
+    ORDER_EVENTS_POLL_INTERVAL = float(os.environ.get('ORDER_EVENTS_POLL_INTERVAL', 0.5))  # seconds
+    ORDER_EVENTS_RETENTION = int(os.environ.get('ORDER_EVENTS_RETENTION', 3600))  # seconds
+    # Customer order pages long-poll for status changes: each request waits
+    # at most ORDER_STATUS_POLL_WAIT seconds, and only ORDER_STATUS_MAX_WAITERS
+    # per worker wait at once; the others poll every ORDER_STATUS_POLL_INTERVAL
+    ORDER_STATUS_POLL_WAIT = float(os.environ.get('ORDER_STATUS_POLL_WAIT', 20))  # seconds
+    ORDER_STATUS_MAX_WAITERS = int(os.environ.get('ORDER_STATUS_MAX_WAITERS',
+                                                  max(1, int(os.environ.get('WEB_THREADS', 4)) // 2)))
+    ORDER_STATUS_POLL_INTERVAL = float(os.environ.get('ORDER_STATUS_POLL_INTERVAL', 10))  # seconds
+    # Checkout stock holds: how long a hold lasts, how stale the per-worker
+    # held totals may be, and how the sweeper releases expired holds
+    RESERVATION_TTL = int(os.environ.get('RESERVATION_TTL', 600))  # seconds
+    RESERVATION_CACHE_TTL = float(os.environ.get('RESERVATION_CACHE_TTL', 5))  # seconds
+    RESERVATION_SWEEP_INTERVAL = float(os.environ.get('RESERVATION_SWEEP_INTERVAL', 30))  # seconds
+    RESERVATION_SWEEP_BATCH = int(os.environ.get('RESERVATION_SWEEP_BATCH', 500))
+    # `flask archive-orders` moves delivered/cancelled orders this old out of
+    # the hot order tables, this many per transaction
+    ORDER_ARCHIVE_AFTER_DAYS = int(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', 30))
+    ORDER_ARCHIVE_BATCH = int(os.environ.get('ORDER_ARCHIVE_BATCH', 500))
+    # Demand forecast behind the restock report: days of history read, days
+    # averaged for the current demand level, days ahead checked for stock-outs
+    FORECAST_HISTORY_DAYS = int(os.environ.get('FORECAST_HISTORY_DAYS', 365))
+    FORECAST_WINDOW_DAYS = int(os.environ.get('FORECAST_WINDOW_DAYS', 28))
+    FORECAST_HORIZON_DAYS = int(os.environ.get('FORECAST_HORIZON_DAYS', 28))
+    # A restock should last this long once it arrives, LEAD_TIME days from now
+    FORECAST_COVER_DAYS = int(os.environ.get('FORECAST_COVER_DAYS', 14))
+    FORECAST_LEAD_TIME_DAYS = int(os.environ.get('FORECAST_LEAD_TIME_DAYS', 2))
+    FORECAST_SAFETY_FACTOR = float(os.environ.get('FORECAST_SAFETY_FACTOR', 1.65))  # standard deviations
+    # "Frequently bought together": neighbours kept per product, orders two
+    # products must share to count, and how often workers reload the table
+    RECOMMENDATIONS_TOP_K = int(os.environ.get('RECOMMENDATIONS_TOP_K', 5))
+    RECOMMENDATIONS_MIN_SUPPORT = int(os.environ.get('RECOMMENDATIONS_MIN_SUPPORT', 2))
+    RECOMMENDATIONS_MAX_AGE = int(os.environ.get('RECOMMENDATIONS_MAX_AGE', 600))  # seconds
+    # Delivery batching: ready orders whose postal codes share this many
+    # leading characters and that became ready within the window ride together
+    DISPATCH_POSTAL_PREFIX = int(os.environ.get('DISPATCH_POSTAL_PREFIX', 3))
+    DISPATCH_WINDOW_MINUTES = int(os.environ.get('DISPATCH_WINDOW_MINUTES', 15))
+    DISPATCH_BATCH_CAPACITY = int(os.environ.get('DISPATCH_BATCH_CAPACITY', 5))  # orders per rider
+    # Kitchen queue: stations working in parallel, promised prep time per
+    # order, and the prep-time model behind the ready estimates
+    KITCHEN_STATIONS = int(os.environ.get('KITCHEN_STATIONS', 2))
+    KITCHEN_PROMISE_MINUTES = int(os.environ.get('KITCHEN_PROMISE_MINUTES', 30))
+    KITCHEN_ORDER_MINUTES = float(os.environ.get('KITCHEN_ORDER_MINUTES', 2))  # packing, per order
+    KITCHEN_ITEM_MINUTES = float(os.environ.get('KITCHEN_ITEM_MINUTES', 1.5))  # per small scoop
+    KITCHEN_TOPPING_MINUTES = float(os.environ.get('KITCHEN_TOPPING_MINUTES', 0.5))  # per topping per scoop
+    # Product import: images fetched in parallel, and how long each may take
+    PRODUCT_IMPORT_WORKERS = int(os.environ.get('PRODUCT_IMPORT_WORKERS', 8))
+    PRODUCT_IMPORT_TIMEOUT = float(os.environ.get('PRODUCT_IMPORT_TIMEOUT', 10))  # seconds
     STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY')
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
-    STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
\ No newline at end of file
+    STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+
+    # Email configuration
+    MAIL_SERVER = 'smtp.gmail.com'
+    MAIL_PORT = 587
+    MAIL_USE_TLS = True
+    MAIL_USERNAME = os.environ.get('EMAIL_USER', 'your-email@gmail.com')
+    MAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD', 'your-app-password')
+    MAIL_DEFAULT_SENDER = os.environ.get('EMAIL_USER', 'your-email@gmail.com')
\ No newline at end of file
@@ -0,0 +1,156 @@
+import threading
+from datetime import datetime, timedelta
+from models import db, Order, Address, User
+from events import order_events
+from replica import use_primary
+
+# Delivery batching for riders. Each worker process keeps the ready delivery
+# orders in memory, indexed by area, and follows the order event feed to add
+# orders as they become ready and drop them when they leave for delivery or
+# are cancelled. Building the board groups what is already in memory; the
+# database is only read for orders that just became ready.
+
+class DeliveryStop:
+    def __init__(self, order_id, area, postal_code, city, street, customer, item_count, total_amount, ready_at):
+        self.order_id = order_id
+        self.area = area
+        self.postal_code = postal_code
+        self.city = city
+        self.street = street
+        self.customer = customer
+        self.item_count = item_count
+        self.total_amount = total_amount
+        self.ready_at = ready_at
+
+class DeliveryBatch:
+    def __init__(self, area, stops, due):
+        self.area = area
+        self.stops = stops
+        self.first_ready_at = stops[0].ready_at
+        # The first order has waited a full window; send a rider now
+        self.due = due
+
+    @property
+    def order_ids(self):
+        return [stop.order_id for stop in self.stops]
+
+class DispatchBoard:
+    def __init__(self, window=15, capacity=5, prefix_length=3):
+        self.window = window
+        self.capacity = capacity
+        self.prefix_length = prefix_length
+        # order id -> stop, and area -> {order id: stop}
+        self._stops = {}
+        self._areas = {}
+        self._subscription = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.events_applied = 0
+
+    def init_app(self, app):
+        self.window = app.config.get('DISPATCH_WINDOW_MINUTES', self.window)
+        self.capacity = app.config.get('DISPATCH_BATCH_CAPACITY', self.capacity)
+        self.prefix_length = app.config.get('DISPATCH_POSTAL_PREFIX', self.prefix_length)
+
+    # Neighbouring postal codes share a prefix; addresses without a usable
+    # postal code are grouped by city
+    def area_of(self, postal_code, city):
+        postal_code = (postal_code or '').replace(' ', '').upper()
+        if len(postal_code) >= self.prefix_length:
+            return postal_code[:self.prefix_length]
+        return (city or '').strip().lower() or 'unknown'
+
+    def _load(self, order_ids=None):
+        query = db.session.query(
+            Order.id, Order.item_count, Order.total_amount, Order.updated_at,
+            Address.postal_code, Address.city, Address.street, User.username
+        ).join(Address, Address.id == Order.address_id).join(User, User.id == Order.user_id) \
+            .filter(Order.status == 'ready')
+        if order_ids is not None:
+            query = query.filter(Order.id.in_(order_ids))
+        for row in query:
+            self._add(DeliveryStop(row.id, self.area_of(row.postal_code, row.city), row.postal_code, row.city,
+                                   row.street, row.username, row.item_count, row.total_amount, row.updated_at))
+
+    def _add(self, stop):
+        self._remove(stop.order_id)
+        self._stops[stop.order_id] = stop
+        self._areas.setdefault(stop.area, {})[stop.order_id] = stop
+
+    def _remove(self, order_id):
+        stop = self._stops.pop(order_id, None)
+        if stop is not None:
+            area = self._areas[stop.area]
+            del area[order_id]
+            if not area:
+                del self._areas[stop.area]
+
+    # Rebuilds the index from the database. The feed is joined at the cursor
+    # taken before the query, so changes made meanwhile are replayed on top.
+    def _reload(self):
+        if self._subscription is not None:
+            order_events.unsubscribe(self._subscription)
+        cursor = order_events.cursor()
+        self._stops = {}
+        self._areas = {}
+        self._load()
+        self._subscription = order_events.subscribe(last_event_id=cursor)
+        self.reloads += 1
+
+    # Applies the order events received since the last call; orders that
+    # became ready are read in one query
+    def sync(self):
+        # Orders announced by the feed may not have reached a read replica yet
+        with self._lock, use_primary():
+            if self._subscription is None or self._subscription.overflowed:
+                self._reload()
+            newly_ready = set()
+            for event in self._subscription.drain():
+                if event.get('status') == 'ready':
+                    newly_ready.add(event['order_id'])
+                elif 'status' in event:
+                    newly_ready.discard(event['order_id'])
+                    self._remove(event['order_id'])
+                self.events_applied += 1
+            if newly_ready:
+                self._load(newly_ready)
+
+    # Drops orders this process just moved on, ahead of their events
+    def discard(self, order_ids):
+        with self._lock:
+            for order_id in order_ids:
+                self._remove(order_id)
+
+    # Batches per area, oldest ready order first. A batch starts with the
+    # longest waiting order and takes the next ones from the same area that
+    # became ready within the window, up to the rider's capacity.
+    def batches(self, now=None):
+        self.sync()
+        now = now or datetime.utcnow()
+        window = timedelta(minutes=self.window)
+        with self._lock:
+            areas = {area: sorted(stops.values(), key=lambda stop: (stop.ready_at, stop.order_id))
+                     for area, stops in self._areas.items()}
+        batches = []
+        for area, stops in areas.items():
+            current = []
+            for stop in stops:
+                if current and (len(current) >= self.capacity or stop.ready_at - current[0].ready_at > window):
+                    batches.append(DeliveryBatch(area, current, now - current[0].ready_at >= window))
+                    current = []
+                current.append(stop)
+            if current:
+                batches.append(DeliveryBatch(area, current, now - current[0].ready_at >= window))
+        batches.sort(key=lambda batch: batch.first_ready_at)
+        return batches
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready_deliveries': len(self._stops),
+                'areas': len(self._areas),
+                'reloads': self.reloads,
+                'events_applied': self.events_applied
+            }
+
+dispatch_board = DispatchBoard()
@@ -0,0 +1,232 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import db, OrderEvent
+
+# Order event fan-out for live screens.
+#
+# Publishing adds an OrderEvent row to the caller's transaction, so an event
+# exists exactly when the change it describes was committed. The order_event
+# table is the local stand-in for a message broker: one poller thread per
+# worker process reads new rows and hands each event to the clients watching
+# it, the admin board and that order's customer. However many screens are
+# open, each process runs one small query per poll interval and clients never
+# touch the database.
+
+class Subscription:
+    def __init__(self, order_id=None, max_size=100):
+        self.order_id = order_id
+        self.queue = queue.Queue(maxsize=max_size)
+        self.overflowed = False
+
+    def wants(self, event):
+        return self.order_id is None or event['order_id'] == self.order_id
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A client that can't keep up is told to reload instead of
+            # holding back everyone else
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    # Everything queued so far, without waiting, for readers that poll
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except queue.Empty:
+                return events
+
+class OrderEventHub:
+    def __init__(self, poll_interval=0.5, backlog=500, retention=3600, queue_size=100, max_waiters=2):
+        self.poll_interval = poll_interval
+        self.backlog = backlog
+        self.retention = retention
+        self.queue_size = queue_size
+        # Long-poll requests allowed to wait at once in this process
+        self.max_waiters = max_waiters
+        self._waiters = threading.BoundedSemaphore(max_waiters)
+        self.app = None
+        # order_id -> subscriptions; None holds the ones that want every order
+        self._subscribers = {}
+        self._recent = deque(maxlen=backlog)
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self.published = 0
+        self.delivered = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = app.config.get('ORDER_EVENTS_POLL_INTERVAL', self.poll_interval)
+        self.retention = app.config.get('ORDER_EVENTS_RETENTION', self.retention)
+        self.max_waiters = app.config.get('ORDER_STATUS_MAX_WAITERS', self.max_waiters)
+        self._waiters = threading.BoundedSemaphore(self.max_waiters)
+
+    # Adds the event to the current transaction; it is delivered once the
+    # caller commits
+    def publish(self, order_id, kind, **fields):
+        payload = dict(fields, order_id=order_id, kind=kind)
+        db.session.add(OrderEvent(order_id=order_id, kind=kind, payload=json.dumps(payload, default=str)))
+        self.published += 1
+
+    # Same change applied to many orders: one multi-row INSERT in the
+    # caller's transaction, delivered to clients as a single poll batch
+    def publish_many(self, order_ids, kind, **fields):
+        rows = [{
+            'order_id': order_id,
+            'kind': kind,
+            'payload': json.dumps(dict(fields, order_id=order_id, kind=kind), default=str)
+        } for order_id in order_ids]
+        if rows:
+            db.session.execute(OrderEvent.__table__.insert(), rows)
+            self.published += len(rows)
+
+    def subscribe(self, last_event_id=None, order_id=None):
+        self._ensure_poller()
+        subscription = Subscription(order_id=order_id, max_size=self.queue_size)
+        with self._lock:
+            # Replay what the client missed while reconnecting, from memory
+            if last_event_id is not None:
+                if self._recent and last_event_id < self._recent[0]['id'] - 1:
+                    subscription.overflowed = True
+                for event in self._recent:
+                    if event['id'] > last_event_id and subscription.wants(event):
+                        subscription.offer(event)
+            self._subscribers.setdefault(order_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.order_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.order_id]
+
+    # One long-poll for an order's events after last_event_id. Anything
+    # already missed is returned at once; otherwise the request waits up to
+    # timeout seconds for the next event, but only if fewer than max_waiters
+    # requests are waiting, so waiting customers never hold every request
+    # thread. Returns (events, reset, waited).
+    def wait_for(self, order_id, last_event_id, timeout):
+        subscription = self.subscribe(last_event_id=last_event_id, order_id=order_id)
+        try:
+            events = subscription.drain()
+            waited = False
+            if not events and not subscription.overflowed and self._waiters.acquire(blocking=False):
+                waited = True
+                try:
+                    event = subscription.get(timeout=timeout)
+                finally:
+                    self._waiters.release()
+                if event is not None:
+                    events = [event] + subscription.drain()
+            return events, subscription.overflowed, waited
+        finally:
+            self.unsubscribe(subscription)
+
+    # Id of the newest event this process has seen. A page renders it with
+    # the order it shows, and its stream resumes from there, so a change made
+    # between the render and the connect is replayed instead of lost.
+    def cursor(self):
+        self._ensure_poller()
+        return self._last_id
+
+    # The poller is started by the first subscriber so no thread exists
+    # before a pre-fork server forks its workers
+    def _ensure_poller(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                # Runs inside the first subscriber's request, on its session
+                recent = OrderEvent.query.order_by(OrderEvent.id.desc()).limit(self.backlog).all()
+                self._recent.extend(self._to_event(row) for row in reversed(recent))
+                self._last_id = recent[0].id if recent else 0
+                self._thread = threading.Thread(target=self._poll_loop, name='order-events', daemon=True)
+                self._thread.start()
+
+    def _to_event(self, row):
+        event = json.loads(row.payload)
+        event['id'] = row.id
+        return event
+
+    def _poll_loop(self):
+        last_prune = 0
+        while True:
+            try:
+                with self.app.app_context():
+                    rows = OrderEvent.query.filter(OrderEvent.id > self._last_id).order_by(OrderEvent.id).all()
+                    if time.monotonic() - last_prune > 60:
+                        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+                        # The newest event always stays: SQLite hands out
+                        # max(id) + 1, so an emptied table would restart ids
+                        # below every poller's cursor
+                        newest_id = db.session.query(func.max(OrderEvent.id)).scalar() or 0
+                        OrderEvent.query.filter(OrderEvent.created_at < cutoff, OrderEvent.id < newest_id) \
+                            .delete(synchronize_session=False)
+                        db.session.commit()
+                        last_prune = time.monotonic()
+                    db.session.remove()
+                if rows:
+                    self._dispatch([self._to_event(row) for row in rows])
+            except Exception:
+                self.app.logger.exception('Order event poller failed')
+            time.sleep(self.poll_interval)
+
+    def _dispatch(self, events):
+        with self._lock:
+            for event in events:
+                self._recent.append(event)
+                self._last_id = event['id']
+                # Only the board and that order's own watchers are touched,
+                # however many customers are waiting on other orders
+                watchers = self._subscribers.get(event['order_id'], ())
+                for subscription in [*self._subscribers.get(None, ()), *watchers]:
+                    subscription.offer(event)
+                    self.delivered += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': sum(len(subscriptions) for subscriptions in self._subscribers.values()),
+                'watched_orders': len([order_id for order_id in self._subscribers if order_id is not None]),
+                'last_event_id': self._last_id,
+                'published': self.published,
+                'delivered': self.delivered
+            }
+
+order_events = OrderEventHub()
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['kind']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+# Streams events to one client until it disconnects, sending a comment line
+# as a keepalive so proxies don't close idle connections
+def event_stream(subscription, keepalive=15):
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            if subscription.overflowed:
+                yield 'event: reset\ndata: {}\n\n'
+                return
+            event = subscription.get(timeout=keepalive)
+            if event is None:
+                yield ': keepalive\n\n'
+            else:
+                yield format_sse(event)
+    finally:
+        order_events.unsubscribe(subscription)
@@ -0,0 +1,166 @@
+import math
+from itertools import chain
+from datetime import date, datetime, timedelta
+import numpy as np
+from sqlalchemy import text
+from models import db, Product
+
+# Demand forecast and restock recommendations for the admin report.
+#
+# Sales are summed per product and day in SQL, hot and archived orders
+# alike, and the rest is array arithmetic on a products x days matrix: no
+# Python loop runs per order, per item or per day, so a year of history is
+# a handful of vectorized passes.
+
+DAILY_DEMAND_SQL = text('''
+    SELECT product_id, CAST(julianday(date(created_at)) + 0.5 AS INTEGER) AS day, SUM(quantity)
+    FROM (SELECT i.product_id, i.quantity, o.created_at
+          FROM order_item i JOIN "order" o ON o.id = i.order_id
+          WHERE o.status != 'cancelled' AND o.created_at >= :since AND o.created_at < :until
+          UNION ALL
+          SELECT i.product_id, i.quantity, o.created_at
+          FROM archived_order_item i JOIN archived_order o ON o.id = i.order_id
+          WHERE o.status != 'cancelled' AND o.created_at >= :since AND o.created_at < :until)
+    GROUP BY product_id, day
+''')
+
+# Julian day number of 1970-01-01; JDN % 7 is the weekday with Monday = 0
+EPOCH_JDN = 2440588
+
+# Weekday factors are pulled towards 1 until this many weeks of history
+# back them, so a single busy Saturday doesn't become a rule
+SEASONALITY_PRIOR_WEEKS = 4
+
+# Integer result rows as a (rows, columns) array. Rows are chained into one
+# flat iterator because handing SQLAlchemy rows to np.array directly makes
+# it probe every row as a mapping.
+def int_array(result, columns):
+    return np.fromiter(chain.from_iterable(result), dtype=np.int64).reshape(-1, columns)
+
+def _jdn(day):
+    return EPOCH_JDN + (day - date(1970, 1, 1)).days
+
+# Units sold per product per day as a (products, days) array covering the
+# complete days before today, starting at the first sale in the window
+def load_daily_demand(product_ids, history_days, today=None):
+    today = today or datetime.utcnow().date()
+    since = today - timedelta(days=history_days)
+    data = int_array(db.session.execute(DAILY_DEMAND_SQL, {
+        'since': datetime.combine(since, datetime.min.time()),
+        'until': datetime.combine(today, datetime.min.time())
+    }), 3)
+
+    end = _jdn(today)
+    start = int(data[:, 1].min()) if len(data) else end - 1
+
+    # Sales of products that no longer exist are dropped
+    ids = np.asarray(product_ids, dtype=np.int64)
+    order = np.argsort(ids)
+    slot = np.searchsorted(ids[order], data[:, 0])
+    slot = np.minimum(slot, max(len(ids) - 1, 0))
+    known = (ids[order][slot] == data[:, 0]) if len(ids) else np.zeros(len(data), dtype=bool)
+
+    demand = np.zeros((len(ids), end - start), dtype=np.float64)
+    np.add.at(demand, (order[slot[known]], data[known, 1] - start), data[known, 2])
+    return demand, start
+
+# Each weekday's demand relative to the average day, per product, Monday first
+def seasonal_factors(demand, start):
+    days = demand.shape[1]
+    weekdays = (start + np.arange(days)) % 7
+    day_counts = np.bincount(weekdays, minlength=7)
+    totals = np.zeros((demand.shape[0], 7))
+    np.add.at(totals.T, weekdays, demand.T)
+
+    mean = demand.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factors = (totals / np.maximum(day_counts, 1)) / mean
+    factors = np.where(np.isfinite(factors) & (day_counts > 0), factors, 1.0)
+
+    weeks = days / 7
+    return 1 + (factors - 1) * (weeks / (weeks + SEASONALITY_PRIOR_WEEKS))
+
+# Trailing mean over the last `window` days, for every day of the series
+def rolling_average(demand, window):
+    cumulative = np.cumsum(np.pad(demand, ((0, 0), (1, 0))), axis=1)
+    counts = np.minimum(np.arange(1, demand.shape[1] + 1), window)
+    lagged = cumulative[:, np.maximum(np.arange(1, demand.shape[1] + 1) - window, 0)]
+    return (cumulative[:, 1:] - lagged) / counts
+
+# The level is the seasonally adjusted average of the last `window` days and
+# each forecast day is that level times its weekday's factor. The restock
+# covers lead_time + cover_days of forecast demand plus a safety margin of
+# safety_factor standard deviations of recent daily demand.
+def forecast_demand(product_ids, stock, history_days=365, window=28, horizon=28,
+                    cover_days=14, lead_time=2, safety_factor=1.65, today=None):
+    today = today or datetime.utcnow().date()
+    stock = np.asarray(stock, dtype=np.float64)
+    demand, start = load_daily_demand(product_ids, history_days, today)
+    factors = seasonal_factors(demand, start)
+
+    past_weekdays = (start + np.arange(demand.shape[1])) % 7
+    adjusted = demand / factors[:, past_weekdays]
+    recent = adjusted[:, -window:]
+    level = recent.mean(axis=1)
+    spread = recent.std(axis=1)
+
+    future_weekdays = (_jdn(today) + np.arange(horizon)) % 7
+    daily = level[:, None] * factors[:, future_weekdays]
+    cumulative = np.cumsum(daily, axis=1)
+
+    # First day on which forecast sales exceed the stock on hand
+    short = cumulative > stock[:, None]
+    runs_out = short.any(axis=1)
+    stockout_day = np.where(runs_out, short.argmax(axis=1), -1)
+
+    cover = lead_time + cover_days
+    cover_demand = level * factors[:, (_jdn(today) + np.arange(cover)) % 7].sum(axis=1)
+    target = cover_demand + safety_factor * spread * math.sqrt(cover)
+    restock = np.ceil(np.maximum(target - stock, 0))
+
+    return {
+        'history_start': today - timedelta(days=demand.shape[1]),
+        'weekday_factors': factors,
+        'average_7': rolling_average(demand, 7)[:, -1],
+        'average_window': rolling_average(demand, window)[:, -1],
+        'daily_forecast': daily,
+        'cover_demand': cover_demand,
+        'stockout_day': stockout_day,
+        'restock': restock
+    }
+
+# Rows for the admin report, products that run out soonest first
+def restock_report(config, today=None):
+    today = today or datetime.utcnow().date()
+    products = db.session.query(Product.id, Product.name, Product.category, Product.stock).order_by(Product.id).all()
+    result = forecast_demand(
+        [product.id for product in products],
+        [product.stock or 0 for product in products],
+        history_days=config['FORECAST_HISTORY_DAYS'],
+        window=config['FORECAST_WINDOW_DAYS'],
+        horizon=config['FORECAST_HORIZON_DAYS'],
+        cover_days=config['FORECAST_COVER_DAYS'],
+        lead_time=config['FORECAST_LEAD_TIME_DAYS'],
+        safety_factor=config['FORECAST_SAFETY_FACTOR'],
+        today=today
+    )
+
+    rows = []
+    for index, product in enumerate(products):
+        stockout_day = int(result['stockout_day'][index])
+        factors = result['weekday_factors'][index]
+        rows.append({
+            'product': product,
+            'average_7': float(result['average_7'][index]),
+            'average_window': float(result['average_window'][index]),
+            'next_7_days': float(result['daily_forecast'][index, :7].sum()),
+            'cover_demand': float(result['cover_demand'][index]),
+            'stockout_date': today + timedelta(days=stockout_day) if stockout_day >= 0 else None,
+            # Runs out before a restock ordered today would arrive
+            'urgent': 0 <= stockout_day <= config['FORECAST_LEAD_TIME_DAYS'],
+            'restock': int(result['restock'][index]),
+            'busiest_weekday': int(factors.argmax()),
+            'weekday_factors': [round(float(factor), 2) for factor in factors]
+        })
+    rows.sort(key=lambda row: (row['stockout_date'] is None, row['stockout_date'] or today, -row['restock']))
+    return rows, result['history_start']
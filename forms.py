@@ -14,6 +14,14 @@ class RegisterForm(FlaskForm):
     password = PasswordField('Password', validators=[DataRequired(), Length(min=6)])
     submit = SubmitField('Register')
 
+# Product categories offered in the admin forms and accepted by imports
+PRODUCT_CATEGORIES = [
+    ('classic', 'Classic'),
+    ('premium', 'Premium'),
+    ('sorbet', 'Sorbet'),
+    ('vegan', 'Vegan')
+]
+
 class ProductForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired(), Length(max=100)])
     description = TextAreaField('Description', validators=[DataRequired()])
@@ -22,12 +30,7 @@ class ProductForm(FlaskForm):
         FileRequired(),
         FileAllowed(['jpg', 'jpeg', 'png', 'gif'], 'Images only!')
     ])
-    category = SelectField('Category', choices=[
-        ('classic', 'Classic'),
-        ('premium', 'Premium'),
-        ('sorbet', 'Sorbet'),
-        ('vegan', 'Vegan')
-    ])
+    category = SelectField('Category', choices=PRODUCT_CATEGORIES)
     stock = IntegerField('Stock', validators=[DataRequired(), NumberRange(min=0)])
     submit = SubmitField('Save Product')
 
@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+from sqlalchemy import text
+from models import db
+
+# Catalog version shared by every worker. Triggers bump it whenever a
+# product field shown on the storefront or a topping price changes; stock updates from orders
+# leave it alone so checkouts don't throw away rendered fragments.
+CATALOG_VERSION_DDL = [
+    '''CREATE TABLE IF NOT EXISTS catalog_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )''',
+    'INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 1)',
+    '''CREATE TRIGGER IF NOT EXISTS catalog_version_insert AFTER INSERT ON product BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS catalog_version_delete AFTER DELETE ON product BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS catalog_version_update
+    AFTER UPDATE OF name, description, price, image_url, category ON product BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END''',
+    # Topping prices feed the pricing table, which reloads on a new version
+    '''CREATE TRIGGER IF NOT EXISTS catalog_version_topping_insert AFTER INSERT ON topping BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS catalog_version_topping_delete AFTER DELETE ON topping BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS catalog_version_topping_update AFTER UPDATE OF price ON topping BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    END''',
+]
+
+def create_catalog_version():
+    for statement in CATALOG_VERSION_DDL:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+def catalog_version():
+    return db.session.execute(text('SELECT version FROM catalog_version WHERE id = 1')).scalar()
+
+# LRU cache of rendered HTML fragments, bounded by the total size of the
+# cached markup rather than by entry count
+class FragmentCache:
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('FRAGMENT_CACHE_MAX_BYTES', self.max_bytes)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, html):
+        size = len(html.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (html, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def get_or_render(self, key, render):
+        html = self.get(key)
+        if html is None:
+            html = render()
+            self.set(key, html)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+fragment_cache = FragmentCache()
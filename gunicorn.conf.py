@@ -0,0 +1,40 @@
+# Gunicorn settings for running the shop in production:
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Every value can be overridden from the environment.
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# Load the app once in the master so workers share the imported code
+preload_app = True
+
+# Workers and threads per worker are sized from the CPU count. Every open
+# live order board holds a thread, so raise WEB_THREADS or switch
+# WORKER_CLASS to gevent when many screens stay connected
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+
+# Recycle workers after a number of requests to bound memory growth;
+# the jitter stops all workers restarting at the same moment
+max_requests = int(os.environ.get('MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', 100))
+
+# Give in-flight requests time to finish on SIGTERM before killing workers
+timeout = int(os.environ.get('WORKER_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+def post_fork(server, worker):
+    # Connections opened in the master must never be shared with a child,
+    # so each worker starts with an empty SQLAlchemy connection pool
+    from wsgi import app
+    from models import db
+    with app.app_context():
+        db.engine.dispose()
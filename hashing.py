@@ -0,0 +1,67 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class HasherBusy(Exception):
+    pass
+
+# Runs password hashing on a small, bounded thread pool. PBKDF2 releases the
+# GIL, so request threads simply wait on the result, but only max_workers
+# hashes run at once per process and at most max_pending may be running or
+# waiting; anything beyond that fails at once with HasherBusy instead of
+# tying up the request threads that serve checkout.
+class PasswordHasher:
+    def __init__(self, max_workers=2, max_pending=3):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+
+    def init_app(self, app):
+        self.max_workers = app.config.get('PASSWORD_HASH_WORKERS', self.max_workers)
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', self.max_pending)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    # The pool is started on first use so no threads exist before a
+    # pre-fork server forks its workers
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='password-hash')
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy()
+        try:
+            result = self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def generate(self, password):
+        return self._run(generate_password_hash, password)
+
+    def check(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._run(check_password_hash, pwhash, password)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'completed': self.completed,
+                'rejected': self.rejected
+            }
+
+password_hasher = PasswordHasher()
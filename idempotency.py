@@ -0,0 +1,31 @@
+import re
+import secrets
+from sqlalchemy import inspect, text
+from models import db, Order
+
+# Checkout idempotency keys. A key is issued when checkout starts and stored
+# on the order it produces; the unique index on order.idempotency_key makes a
+# second order for the same checkout impossible, however the request is
+# replayed.
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+# Adds the column and its unique index to databases created before it existed
+def create_idempotency_key_column():
+    columns = {column['name'] for column in inspect(db.engine).get_columns('order')}
+    if 'idempotency_key' not in columns:
+        db.session.execute(text('ALTER TABLE "order" ADD COLUMN idempotency_key VARCHAR(64)'))
+    db.session.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_order_idempotency_key ON "order" (idempotency_key)'
+    ))
+    db.session.commit()
+
+def new_key():
+    return secrets.token_urlsafe(24)
+
+def valid_key(key):
+    return bool(key) and KEY_PATTERN.match(key) is not None
+
+def find_order(key, user_id):
+    if not valid_key(key):
+        return None
+    return Order.query.filter_by(idempotency_key=key, user_id=user_id).first()
@@ -1,41 +1,187 @@
-from app import app, db, Product
+import os
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from models import db, User, Product
+from search import create_search_index
+from fragment_cache import create_catalog_version
+from idempotency import create_idempotency_key_column
+from order_summary import create_order_summary_columns, backfill_order_summaries
+from user_stats import create_user_stats, rebuild_user_stats
+from archive import create_archive_indexes, archive_stranded_customizations, archive_orders
+from replica import snapshot_replica
+from recommendations import build_recommendations
+from kitchen import create_kitchen_indexes
+from product_import import read_rows, import_products, ProductImportError
+
+def create_admin_user():
+    if not User.query.filter_by(email='admin@example.com').first():
+        admin = User(
+            username='admin',
+            email='admin@example.com',
+            is_admin=True
+        )
+        admin.set_password('admin123')
+        db.session.add(admin)
+        db.session.commit()
+        print("Admin user created.")
+
+def create_sample_products():
+    # Check if we already have products
+    if Product.query.first() is None:
+        sample_products = [
+            Product(
+                name='Vanilla Delight',
+                description='Classic vanilla ice cream made with Madagascar vanilla beans',
+                price=99.99,
+                category='classic',
+                stock=50,
+                image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb?ixlib=rb-1.2.1&auto=format&fit=crop&w=500&q=60'
+            ),
+            Product(
+                name='Chocolate Dream',
+                description='Rich and creamy chocolate ice cream with Belgian chocolate',
+                price=129.99,
+                category='premium',
+                stock=40,
+                image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb?ixlib=rb-1.2.1&auto=format&fit=crop&w=500&q=60'
+            ),
+            Product(
+                name='Strawberry Sorbet',
+                description='Refreshing strawberry sorbet made with fresh strawberries',
+                price=119.99,
+                category='sorbet',
+                stock=30,
+                image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb?ixlib=rb-1.2.1&auto=format&fit=crop&w=500&q=60'
+            ),
+            Product(
+                name='Mango Tango',
+                description='Tropical mango ice cream with real mango pieces',
+                price=139.99,
+                category='premium',
+                stock=35,
+                image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb?ixlib=rb-1.2.1&auto=format&fit=crop&w=500&q=60'
+            ),
+            Product(
+                name='Vegan Coconut',
+                description='Creamy coconut ice cream made with coconut milk',
+                price=149.99,
+                category='vegan',
+                stock=25,
+                image_url='https://images.unsplash.com/photo-1563805042-7684c019e1cb?ixlib=rb-1.2.1&auto=format&fit=crop&w=500&q=60'
+            )
+        ]
+        for product in sample_products:
+            db.session.add(product)
+        db.session.commit()
+        print("Sample products added successfully!")
+    else:
+        print("Products already exist in the database.")
 
 def init_db():
-    with app.app_context():
-        # Create tables
-        db.create_all()
-        
-        # Check if we already have products
-        if Product.query.first() is None:
-            # Add sample products
-            products = [
-                Product(
-                    name='Vanilla Delight',
-                    description='Classic vanilla ice cream',
-                    price=99.99,
-                    image_url='https://example.com/vanilla.jpg'
-                ),
-                Product(
-                    name='Chocolate Dream',
-                    description='Rich chocolate ice cream',
-                    price=129.99,
-                    image_url='https://example.com/chocolate.jpg'
-                ),
-                Product(
-                    name='Strawberry Sorbet',
-                    description='Refreshing strawberry sorbet',
-                    price=119.99,
-                    image_url='https://example.com/strawberry.jpg'
-                )
-            ]
-            
-            for product in products:
-                db.session.add(product)
-            
-            db.session.commit()
-            print("Sample products added successfully!")
-        else:
-            print("Products already exist in the database.")
+    # Create tables on the primary; the replica is a copy made by `flask replicate`
+    db.create_all(bind=None)
+    create_admin_user()
+    create_sample_products()
+    create_search_index()
+    create_catalog_version()
+    create_idempotency_key_column()
+    create_order_summary_columns()
+    create_user_stats()
+    create_archive_indexes()
+    archive_stranded_customizations()
+    create_kitchen_indexes()
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create or upgrade tables, the admin user, sample products and search/cache support tables."""
+    init_db()
+
+@click.command('backfill-order-summaries')
+@click.option('--batch-size', default=500, show_default=True, help='Orders updated per transaction.')
+@with_appcontext
+def backfill_order_summaries_command(batch_size):
+    """Fill the order list summary columns of existing orders from their items."""
+    print(f"Updated {backfill_order_summaries(batch_size)} orders.")
+
+@click.command('rebuild-user-stats')
+@with_appcontext
+def rebuild_user_stats_command():
+    """Recompute every customer's order statistics from the order history."""
+    print(f"Rebuilt statistics for {rebuild_user_stats()} customers.")
+
+@click.command('archive-orders')
+@click.option('--days', type=int, help='Archive orders finished more than this many days ago (ORDER_ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', type=int, help='Orders moved per transaction (ORDER_ARCHIVE_BATCH).')
+@with_appcontext
+def archive_orders_command(days, batch_size):
+    """Move old delivered and cancelled orders into the archive tables."""
+    days = days if days is not None else current_app.config['ORDER_ARCHIVE_AFTER_DAYS']
+    batch_size = batch_size or current_app.config['ORDER_ARCHIVE_BATCH']
+    print(f"Archived {archive_orders(days, batch_size)} orders.")
+
+@click.command('build-recommendations')
+@click.option('--top-k', type=int, help='Neighbours kept per product (RECOMMENDATIONS_TOP_K).')
+@with_appcontext
+def build_recommendations_command(top_k):
+    """Recompute "frequently bought together" suggestions from the order history."""
+    top_k = top_k or current_app.config['RECOMMENDATIONS_TOP_K']
+    count = build_recommendations(top_k, current_app.config['RECOMMENDATIONS_MIN_SUPPORT'])
+    print(f"Stored {count} recommendations.")
+
+@click.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Validate and show what would change without writing anything.')
+@click.option('--images-dir', type=click.Path(exists=True, file_okay=False),
+              help='Folder that local image references are relative to (default: the file\'s folder).')
+@with_appcontext
+def import_products_command(path, dry_run, images_dir):
+    """Create and update products from a CSV or NDJSON file."""
+    config = current_app.config
+    try:
+        with open(path, 'rb') as f:
+            rows = read_rows(f, path)
+    except ProductImportError as e:
+        raise click.ClickException(str(e))
+    report = import_products(
+        rows,
+        dry_run=dry_run,
+        images_dir=images_dir or os.path.dirname(os.path.abspath(path)),
+        workers=config['PRODUCT_IMPORT_WORKERS'],
+        timeout=config['PRODUCT_IMPORT_TIMEOUT'],
+        max_bytes=config['MAX_CONTENT_LENGTH']
+    )
+    for line in report['lines']:
+        print(f"line {line['line']}: {line['action']} {line['name']!r}")
+        for field, (old, new) in line['changes'].items():
+            print(f"    {field}: {old!r} -> {new!r}")
+        for error in line['errors']:
+            print(f"    error: {error}")
+    counts = report['counts']
+    print(f"{counts['create']} to create, {counts['update']} to update, {counts['unchanged']} unchanged, "
+          f"{counts['error']} with errors.")
+    if counts['error']:
+        raise click.ClickException('Nothing was imported.')
+    print('Dry run; nothing was written.' if dry_run else 'Import applied.')
+
+@click.command('replicate')
+@click.option('--interval', type=float, help='Seconds between snapshots (REPLICA_SNAPSHOT_INTERVAL).')
+@click.option('--once', is_flag=True, help='Take a single snapshot and exit.')
+@with_appcontext
+def replicate_command(interval, once):
+    """Keep the SQLite read replica up to date with the primary."""
+    if 'replica' not in (current_app.config.get('SQLALCHEMY_BINDS') or {}):
+        raise click.ClickException('No replica bind configured; set REPLICA_DATABASE_URL.')
+    interval = interval or current_app.config['REPLICA_SNAPSHOT_INTERVAL']
+    while True:
+        snapshot_replica(db, current_app)
+        if once:
+            break
+        time.sleep(interval)
 
 if __name__ == '__main__':
-    init_db() 
\ No newline at end of file
+    from app import create_app
+    with create_app().app_context():
+        init_db()
@@ -0,0 +1,219 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func, text
+from models import db, Order, OrderItem, Customization, customization_toppings
+from events import order_events
+from replica import use_primary
+
+# Kitchen prep queue with ready-time estimates. Each worker process keeps
+# the orders still to be made in a heap ordered by promised time, with
+# orders already being prepared first, and follows the order event feed to
+# keep it current. Adding, reprioritising or removing an order is one heap
+# operation; the schedule behind the ETAs is only recomputed when someone
+# asks after a change.
+
+QUEUED_STATUSES = ('pending', 'processing', 'preparing')
+
+# Prep time of a scoop relative to a small one
+SIZE_FACTORS = {
+    'small': 1.0,
+    'medium': 1.25,
+    'large': 1.5
+}
+
+KITCHEN_INDEX_DDL = [
+    'CREATE INDEX IF NOT EXISTS ix_customization_order_item_id ON customization (order_item_id)',
+]
+
+# Index the prep-time query relies on, for databases created before it
+def create_kitchen_indexes():
+    for statement in KITCHEN_INDEX_DDL:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+class KitchenJob:
+    def __init__(self, order_id, status, prep_minutes, promised_at, started_at):
+        self.order_id = order_id
+        self.status = status
+        self.prep_minutes = prep_minutes
+        self.promised_at = promised_at
+        # When preparation began, for orders being prepared
+        self.started_at = started_at
+
+    def priority(self):
+        return (0 if self.status == 'preparing' else 1, self.promised_at, self.order_id)
+
+class KitchenQueue:
+    def __init__(self, stations=2, promise_minutes=30, order_minutes=2.0, item_minutes=1.5,
+                 topping_minutes=0.5, refresh=60):
+        self.stations = stations
+        self.promise_minutes = promise_minutes
+        self.order_minutes = order_minutes
+        self.item_minutes = item_minutes
+        self.topping_minutes = topping_minutes
+        # Estimates are recomputed at least this often as prep time elapses
+        self.refresh = refresh
+        # Heap of [priority, order id, live] entries. A change pushes a new
+        # entry and marks the old one dead instead of searching the heap.
+        self._heap = []
+        self._entries = {}
+        self._jobs = {}
+        self._schedule = None
+        self._scheduled_at = None
+        self._subscription = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.events_applied = 0
+
+    def init_app(self, app):
+        self.stations = app.config.get('KITCHEN_STATIONS', self.stations)
+        self.promise_minutes = app.config.get('KITCHEN_PROMISE_MINUTES', self.promise_minutes)
+        self.order_minutes = app.config.get('KITCHEN_ORDER_MINUTES', self.order_minutes)
+        self.item_minutes = app.config.get('KITCHEN_ITEM_MINUTES', self.item_minutes)
+        self.topping_minutes = app.config.get('KITCHEN_TOPPING_MINUTES', self.topping_minutes)
+
+    # Minutes to make each order matching condition: a fixed packing time
+    # plus every scoop, scaled by its size, plus its toppings
+    def _prep_minutes(self, order_ids, condition):
+        minutes = {order_id: self.order_minutes for order_id in order_ids}
+        rows = db.session.query(
+            OrderItem.order_id, OrderItem.quantity, Customization.size,
+            func.count(customization_toppings.c.topping_id)
+        ).join(Order, Order.id == OrderItem.order_id) \
+            .outerjoin(Customization, Customization.order_item_id == OrderItem.id) \
+            .outerjoin(customization_toppings, customization_toppings.c.customization_id == Customization.id) \
+            .filter(condition) \
+            .group_by(OrderItem.id)
+        for order_id, quantity, size, toppings in rows:
+            if order_id in minutes:
+                minutes[order_id] += quantity * (self.item_minutes * SIZE_FACTORS.get(size, 1.0)
+                                                 + self.topping_minutes * toppings)
+        return minutes
+
+    def _load(self, order_ids=None):
+        condition = Order.status.in_(QUEUED_STATUSES)
+        if order_ids is not None:
+            condition = condition & Order.id.in_(order_ids)
+        rows = db.session.query(Order.id, Order.status, Order.created_at, Order.updated_at).filter(condition).all()
+        if not rows:
+            return
+        minutes = self._prep_minutes([row.id for row in rows], condition)
+        for row in rows:
+            self._push(KitchenJob(
+                row.id, row.status, minutes[row.id],
+                row.created_at + timedelta(minutes=self.promise_minutes),
+                row.updated_at if row.status == 'preparing' else None
+            ))
+
+    def _push(self, job):
+        self._remove(job.order_id)
+        entry = [job.priority(), job.order_id, True]
+        self._jobs[job.order_id] = job
+        self._entries[job.order_id] = entry
+        heapq.heappush(self._heap, entry)
+        self._schedule = None
+
+    def _remove(self, order_id):
+        entry = self._entries.pop(order_id, None)
+        if entry is not None:
+            entry[2] = False
+            del self._jobs[order_id]
+            self._schedule = None
+            # Dead entries are dropped once they outnumber the live ones
+            if len(self._heap) > 2 * len(self._entries) + 32:
+                self._heap = [entry for entry in self._heap if entry[2]]
+                heapq.heapify(self._heap)
+
+    # Rebuilds the queue from the database, joining the feed at the cursor
+    # taken before the query so changes made meanwhile are replayed on top
+    def _reload(self):
+        if self._subscription is not None:
+            order_events.unsubscribe(self._subscription)
+        cursor = order_events.cursor()
+        self._heap = []
+        self._entries = {}
+        self._jobs = {}
+        self._schedule = None
+        self._load()
+        self._subscription = order_events.subscribe(last_event_id=cursor)
+        self.reloads += 1
+
+    def sync(self):
+        # Orders announced by the feed may not have reached a read replica yet
+        with self._lock, use_primary():
+            if self._subscription is None or self._subscription.overflowed:
+                self._reload()
+            added = set()
+            for event in self._subscription.drain():
+                order_id, status = event['order_id'], event.get('status')
+                job = self._jobs.get(order_id)
+                if status not in QUEUED_STATUSES:
+                    added.discard(order_id)
+                    self._remove(order_id)
+                elif job is None:
+                    added.add(order_id)
+                elif job.status != status:
+                    started_at = datetime.fromisoformat(event['updated_at']) if status == 'preparing' else None
+                    self._push(KitchenJob(order_id, status, job.prep_minutes, job.promised_at, started_at))
+                self.events_applied += 1
+            if added:
+                self._load(added)
+
+    # Drops orders this process just moved out of the kitchen, ahead of
+    # their events
+    def discard(self, order_ids):
+        with self._lock:
+            for order_id in order_ids:
+                self._remove(order_id)
+
+    # Walks the queue in priority order, giving each order to the station
+    # that frees up first. Orders being prepared only need what is left of
+    # their prep time.
+    def _build_schedule(self, now):
+        stations = [0.0] * max(self.stations, 1)
+        schedule = {}
+        entries = [entry for entry in self._heap if entry[2]]
+        heapq.heapify(entries)
+        position = 0
+        while entries:
+            _, order_id, _ = heapq.heappop(entries)
+            job = self._jobs[order_id]
+            remaining = job.prep_minutes
+            if job.started_at is not None:
+                elapsed = (now - job.started_at).total_seconds() / 60
+                remaining = max(remaining - elapsed, 1.0)
+            position += 1
+            finish = heapq.heappop(stations) + remaining
+            heapq.heappush(stations, finish)
+            schedule[order_id] = {
+                'position': position,
+                'minutes': max(int(round(finish)), 1),
+                'eta': now + timedelta(minutes=finish),
+                'late': now + timedelta(minutes=finish) > job.promised_at
+            }
+        return schedule
+
+    # Estimates for every queued order, by order id
+    def schedule(self, now=None):
+        self.sync()
+        now = now or datetime.utcnow()
+        with self._lock:
+            if self._schedule is None or (now - self._scheduled_at).total_seconds() >= self.refresh:
+                self._schedule = self._build_schedule(now)
+                self._scheduled_at = now
+            return self._schedule
+
+    def eta(self, order_id):
+        return self.schedule().get(order_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': len(self._jobs),
+                'heap_entries': len(self._heap),
+                'reloads': self.reloads,
+                'events_applied': self.events_applied
+            }
+
+kitchen_queue = KitchenQueue()
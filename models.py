@@ -1,9 +1,10 @@
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from hashing import password_hasher
 from datetime import datetime
+from replica import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+# Sessions route read-only views to the replica bind when one is configured
+db = RoutingSQLAlchemy()
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -14,11 +15,12 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     orders = db.relationship('Order', backref='user', lazy=True)
 
+    # Hashing runs on a bounded pool and may raise hashing.HasherBusy
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.generate(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.check(self.password_hash, password)
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -26,7 +28,7 @@ class Product(db.Model):
     description = db.Column(db.Text)
     price = db.Column(db.Float, nullable=False)
     image_url = db.Column(db.String(200))
-    category = db.Column(db.String(50))
+    category = db.Column(db.String(50), index=True)
     stock = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     order_items = db.relationship('OrderItem', backref='product', lazy=True)
@@ -54,12 +56,136 @@ class Order(db.Model):
     total_amount = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Checkout that created this order; replays of it find this order
+    idempotency_key = db.Column(db.String(64), unique=True, index=True)
+    # Item summary for list pages, written with the items; see order_summary.py
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    item_preview = db.Column(db.String(200))
+    has_customizations = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    __table_args__ = (
+        db.Index('ix_order_user_created', 'user_id', 'created_at'),
+        db.Index('ix_order_status_updated', 'status', 'updated_at'),
+    )
     items = db.relationship('OrderItem', backref='order', lazy=True)
     address = db.relationship('Address', backref='orders')
+    is_archived = False
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    price = db.Column(db.Float, nullable=False)  # Price at time of purchase
\ No newline at end of file
+    price = db.Column(db.Float, nullable=False)  # Price at time of purchase
+
+# Models for customization
+class Topping(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    image_url = db.Column(db.String(200))
+    description = db.Column(db.Text)
+
+class Customization(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_item_id = db.Column(db.Integer, db.ForeignKey('order_item.id'), nullable=False, index=True)
+    size = db.Column(db.String(20), nullable=False)  # small, medium, large
+    container = db.Column(db.String(20), nullable=False)  # cone, cup
+    toppings = db.relationship('Topping', secondary='customization_toppings')
+    extra_notes = db.Column(db.Text)
+    order_item = db.relationship('OrderItem')
+
+# Association table for customization toppings
+customization_toppings = db.Table('customization_toppings',
+    db.Column('customization_id', db.Integer, db.ForeignKey('customization.id'), primary_key=True),
+    db.Column('topping_id', db.Integer, db.ForeignKey('topping.id'), primary_key=True)
+)
+
+# Append-only log of order changes. It is written in the same transaction as
+# the change itself and doubles as the broker that carries events to every
+# worker process; see events.py.
+class OrderEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)  # created, status
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+# Stock held for a checkout while the customer is on the payment page. Holds
+# expire on their own; see reservations.py.
+class StockReservation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    checkout_key = db.Column(db.String(64), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+# Running totals per customer, kept up to date as orders are placed and
+# cancelled so the profile page reads one row; see user_stats.py.
+# Cancelled orders don't count towards spend, order count or favorites.
+class UserStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    lifetime_spend = db.Column(db.Float, nullable=False, default=0)
+    last_order_at = db.Column(db.DateTime)
+    favorite_product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
+    favorite_product = db.relationship('Product')
+
+# Units of each product a customer has bought, used to pick the favorite
+class UserProductStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.Index('ix_user_product_stats_rank', 'user_id', 'quantity'),)
+
+# Finished orders moved out of the order, order_item and customization
+# tables by archive.py. Same columns as the hot tables, read-only.
+class ArchivedOrder(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    address_id = db.Column(db.Integer, db.ForeignKey('address.id'), nullable=True)
+    status = db.Column(db.String(20))
+    total_amount = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    idempotency_key = db.Column(db.String(64))
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    item_preview = db.Column(db.String(200))
+    has_customizations = db.Column(db.Boolean, nullable=False, default=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_archived_order_user_created', 'user_id', 'created_at'),)
+    items = db.relationship('ArchivedOrderItem', backref='order', lazy=True)
+    address = db.relationship('Address')
+    user = db.relationship('User')
+    is_archived = True
+
+class ArchivedOrderItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('archived_order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    product = db.relationship('Product')
+
+class ArchivedCustomization(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_item_id = db.Column(db.Integer, db.ForeignKey('archived_order_item.id'), nullable=False, index=True)
+    size = db.Column(db.String(20), nullable=False)
+    container = db.Column(db.String(20), nullable=False)
+    toppings = db.relationship('Topping', secondary='archived_customization_toppings')
+    extra_notes = db.Column(db.Text)
+
+archived_customization_toppings = db.Table('archived_customization_toppings',
+    db.Column('customization_id', db.Integer, db.ForeignKey('archived_customization.id'), primary_key=True),
+    db.Column('topping_id', db.Integer, db.ForeignKey('topping.id'), primary_key=True)
+)
+
+# Top neighbours of each product, products bought in the same order and
+# toppings chosen for it, written by `flask build-recommendations`; see
+# recommendations.py
+class ProductRecommendation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    kind = db.Column(db.String(10), nullable=False)  # product, topping
+    related_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
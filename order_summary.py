@@ -0,0 +1,75 @@
+from sqlalchemy import bindparam, inspect, text
+from models import db, Order, OrderItem, Product, Customization
+
+# Denormalized summary of an order's items. List pages read item_count,
+# item_preview and has_customizations from the order row itself instead of
+# loading every item and its product. The columns are written in the same
+# transaction as the items.
+PREVIEW_LENGTH = 200
+
+SUMMARY_COLUMNS = {
+    'item_count': 'INTEGER NOT NULL DEFAULT 0',
+    'item_preview': 'VARCHAR(200)',
+    'has_customizations': 'BOOLEAN NOT NULL DEFAULT 0'
+}
+
+# Adds the columns to databases created before they existed
+def create_order_summary_columns():
+    columns = {column['name'] for column in inspect(db.engine).get_columns('order')}
+    for name, ddl in SUMMARY_COLUMNS.items():
+        if name not in columns:
+            db.session.execute(text(f'ALTER TABLE "order" ADD COLUMN {name} {ddl}'))
+    db.session.commit()
+
+# "2 x Vanilla Delight, 1 x Mango Tango", shortened to "... and 3 more"
+# when it doesn't fit the column
+def build_preview(lines):
+    parts = [f'{quantity} x {name}' for name, quantity in lines]
+    preview = ', '.join(parts)
+    if len(preview) <= PREVIEW_LENGTH:
+        return preview
+    for kept in range(len(parts) - 1, 0, -1):
+        preview = ', '.join(parts[:kept]) + f' and {len(parts) - kept} more'
+        if len(preview) <= PREVIEW_LENGTH:
+            return preview
+    return parts[0][:PREVIEW_LENGTH - 3] + '...'
+
+def summarize(order, lines, customized=False):
+    order.item_count = sum(quantity for _, quantity in lines)
+    order.item_preview = build_preview(lines)
+    order.has_customizations = customized
+
+# Recomputes the summary of every existing order from its items, one batch
+# of orders per transaction
+def backfill_order_summaries(batch_size=500):
+    order_table = Order.__table__
+    update = order_table.update().where(order_table.c.id == bindparam('order_id'))
+    updated = 0
+    last_id = 0
+    while True:
+        order_ids = [order_id for (order_id,) in db.session.query(Order.id)
+                     .filter(Order.id > last_id).order_by(Order.id).limit(batch_size)]
+        if not order_ids:
+            break
+
+        lines = {}
+        rows = db.session.query(OrderItem.order_id, Product.name, OrderItem.quantity) \
+            .outerjoin(Product, Product.id == OrderItem.product_id) \
+            .filter(OrderItem.order_id.in_(order_ids)) \
+            .order_by(OrderItem.id)
+        for order_id, name, quantity in rows:
+            lines.setdefault(order_id, []).append((name or 'Removed product', quantity))
+        customized = {order_id for (order_id,) in db.session.query(OrderItem.order_id)
+                      .join(Customization, Customization.order_item_id == OrderItem.id)
+                      .filter(OrderItem.order_id.in_(order_ids)).distinct()}
+
+        db.session.execute(update, [{
+            'order_id': order_id,
+            'item_count': sum(quantity for _, quantity in lines.get(order_id, [])),
+            'item_preview': build_preview(lines.get(order_id, [])),
+            'has_customizations': order_id in customized
+        } for order_id in order_ids])
+        db.session.commit()
+        updated += len(order_ids)
+        last_id = order_ids[-1]
+    return updated
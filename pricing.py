@@ -0,0 +1,107 @@
+import hashlib
+import json
+import threading
+from models import db, Product, Topping
+from fragment_cache import catalog_version
+
+# Surcharges on top of a product's base price
+SIZE_PRICES = {
+    'small': 0,
+    'medium': 20,
+    'large': 40
+}
+CONTAINER_PRICES = {
+    'cone': 0,
+    'cup': 0
+}
+
+# Immutable snapshot of every price needed to quote a customization. Quotes
+# are computed from plain dicts, so pricing a configuration never touches
+# the database.
+class PriceTable:
+    def __init__(self, products, toppings, sizes=SIZE_PRICES, containers=CONTAINER_PRICES):
+        self.products = products
+        self.toppings = toppings
+        self.sizes = dict(sizes)
+        self.containers = dict(containers)
+        # The version is derived from the contents, so every worker that
+        # loaded the same prices reports the same version
+        digest = hashlib.sha1(json.dumps(
+            [sorted(products.items()), sorted(toppings.items()), sorted(self.sizes.items()), sorted(self.containers.items())]
+        ).encode()).hexdigest()
+        self.version = digest[:12]
+
+    @classmethod
+    def load(cls):
+        products = dict(db.session.query(Product.id, Product.price).all())
+        toppings = dict(db.session.query(Topping.id, Topping.price).all())
+        return cls(products, toppings)
+
+    # Surcharge for size, container and toppings. Unknown sizes and toppings
+    # add nothing, matching how the cart has always priced them.
+    def customization_price(self, size=None, container=None, topping_ids=None):
+        price = self.sizes.get(size, 0) if size else 0
+        price += self.containers.get(container, 0) if container else 0
+        for topping_id in set(topping_ids or []):
+            price += self.toppings.get(_as_int(topping_id), 0)
+        return price
+
+    def quote(self, product_id, size=None, container=None, topping_ids=None):
+        base_price = self.products.get(_as_int(product_id))
+        if base_price is None:
+            return None
+        return base_price + self.customization_price(size, container, topping_ids)
+
+    def as_dict(self):
+        return {
+            'version': self.version,
+            'sizes': self.sizes,
+            'containers': self.containers,
+            'toppings': self.toppings
+        }
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+# Checks the shape of a customization sent by a client before it is priced.
+# Returns an error message, or None when it is well formed.
+def customization_error(size=None, container=None, topping_ids=None):
+    if size is not None and not isinstance(size, str):
+        return 'size must be a string'
+    if container is not None and not isinstance(container, str):
+        return 'container must be a string'
+    if topping_ids is not None and (not isinstance(topping_ids, list)
+                                    or any(isinstance(topping_id, bool) or _as_int(topping_id) is None
+                                           for topping_id in topping_ids)):
+        return 'toppings must be a list of topping ids'
+    return None
+
+# Holds the current PriceTable for this process. Each lookup reads the
+# shared catalog version, which triggers bump on every product or topping
+# price change, so every worker reloads as soon as a price changes rather
+# than only the one that made the change.
+class PricingService:
+    def __init__(self):
+        self._table = None
+        self._catalog_version = None
+        self._lock = threading.Lock()
+
+    def table(self):
+        version = catalog_version()
+        table = self._table
+        if table is not None and self._catalog_version == version:
+            return table
+        with self._lock:
+            if self._table is None or self._catalog_version != version:
+                self._table = PriceTable.load()
+                self._catalog_version = version
+            return self._table
+
+    def invalidate(self):
+        with self._lock:
+            self._table = None
+
+pricing = PricingService()
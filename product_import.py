@@ -0,0 +1,327 @@
+import csv
+import io
+import ipaddress
+import json
+import math
+import os
+import shutil
+import socket
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+from flask import current_app
+from sqlalchemy import bindparam, update
+from werkzeug.utils import secure_filename
+from models import db, Product
+from forms import PRODUCT_CATEGORIES
+
+# Bulk product import from CSV or NDJSON. Every row is validated against
+# the catalog before anything happens; only a clean file fetches its images,
+# on a thread pool, and is then written as one batched INSERT and one
+# batched UPDATE in a single transaction. A dry run stops after validation
+# and reports what would change.
+#
+# Rows are matched to products by id when given, otherwise by name. For an
+# existing product, blank fields keep their current value, so a file of
+# names and stock levels is a valid restock.
+
+IMPORT_FIELDS = ('name', 'description', 'price', 'category', 'stock', 'image')
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+IMAGE_CONTENT_TYPES = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/gif': 'gif'}
+CATEGORIES = [value for value, _ in PRODUCT_CATEGORIES]
+
+class ProductImportError(Exception):
+    pass
+
+# Rows of a CSV file with a header line, or of an NDJSON file with one JSON
+# object per line, as (line number, dict) pairs
+def read_rows(stream, filename):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if filename.lower().endswith(('.ndjson', '.jsonl')):
+        rows = []
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise ProductImportError(f'Line {line_number}: invalid JSON ({e})')
+            if not isinstance(row, dict):
+                raise ProductImportError(f'Line {line_number}: expected a JSON object')
+            rows.append((line_number, row))
+        return rows
+    if filename.lower().endswith('.csv'):
+        reader = csv.DictReader(text)
+        if not reader.fieldnames or 'name' not in reader.fieldnames and 'id' not in reader.fieldnames:
+            raise ProductImportError('The CSV header must include a name or id column')
+        # Data starts on line 2, after the header
+        return [(line_number, row) for line_number, row in enumerate(reader, 2)]
+    raise ProductImportError('Upload a .csv or .ndjson file')
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+# Checks one row against the catalog, mirroring ProductForm. Returns the
+# product it updates (or None for a new one), the validated values and a
+# list of problems.
+def _validate(row, products_by_id, products_by_name):
+    errors = []
+    values = {}
+    product = None
+
+    if not _blank(row.get('id')):
+        try:
+            product = products_by_id.get(int(row['id']))
+        except (TypeError, ValueError):
+            return None, values, ['id must be a whole number']
+        if product is None:
+            return None, values, [f"no product with id {row['id']}"]
+    elif not _blank(row.get('name')):
+        matches = products_by_name.get(str(row['name']).strip(), [])
+        if len(matches) > 1:
+            return None, values, [f"{len(matches)} products are named {row['name']!r}; give an id"]
+        product = matches[0] if matches else None
+
+    for field in IMPORT_FIELDS:
+        value = row.get(field)
+        if _blank(value):
+            if product is None and field != 'stock':
+                errors.append(f'{field} is required')
+            continue
+        value = value.strip() if isinstance(value, str) else value
+        if field == 'name':
+            if len(str(value)) > 100:
+                errors.append('name is longer than 100 characters')
+            values['name'] = str(value)
+        elif field == 'description':
+            values['description'] = str(value)
+        elif field == 'price':
+            try:
+                values['price'] = float(value)
+            except (TypeError, ValueError):
+                values['price'] = math.nan
+            if not math.isfinite(values['price']):
+                del values['price']
+                errors.append('price must be a number')
+                continue
+            if values['price'] < 0:
+                errors.append('price must not be negative')
+        elif field == 'stock':
+            try:
+                values['stock'] = int(value)
+            except (TypeError, ValueError, OverflowError):
+                errors.append('stock must be a whole number')
+                continue
+            if values['stock'] < 0:
+                errors.append('stock must not be negative')
+        elif field == 'category':
+            if value not in CATEGORIES:
+                errors.append(f"category must be one of {', '.join(CATEGORIES)}")
+            values['category'] = value
+        elif field == 'image':
+            values['image'] = str(value)
+    return product, values, errors
+
+def _upload_name(line_number, filename):
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{line_number}_{secure_filename(filename)}"
+
+# Where a row's image comes from: ('keep', url) for a file already in the
+# uploads folder, ('url', url) to download or ('file', path) to copy
+def _image_source(image, images_dir):
+    if image.startswith('/static/uploads/'):
+        if not os.path.exists(os.path.join(current_app.root_path, image.lstrip('/'))):
+            return None, f'image {image} does not exist'
+        return ('keep', image), None
+    scheme = urlparse(image).scheme
+    if scheme in ('http', 'https'):
+        return ('url', image), None
+    if scheme:
+        return None, 'image URLs must use http or https'
+    if images_dir is None:
+        return None, 'image must be a URL or a file already in /static/uploads/'
+    path = os.path.abspath(os.path.join(images_dir, image))
+    # Local references may not climb out of the images folder
+    if not path.startswith(os.path.abspath(images_dir) + os.sep):
+        return None, f'image {image} is outside the images folder'
+    if not os.path.isfile(path):
+        return None, f'image file {image} not found'
+    if path.rsplit('.', 1)[-1].lower() not in IMAGE_EXTENSIONS:
+        return None, 'image must be a png, jpg, jpeg or gif file'
+    return ('file', path), None
+
+# Image URLs come from uploaded files, so the server only fetches from
+# hosts whose every address is public: never loopback, private networks or
+# link-local ones such as the cloud metadata service
+def _check_public_url(url):
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ProductImportError(f'{url} is not an http(s) URL')
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, parsed.port or None)}
+    except (OSError, UnicodeError):
+        raise ProductImportError(f'{parsed.hostname} could not be resolved')
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%', 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ProductImportError(f'{parsed.hostname} is not a public address')
+
+# Redirects are followed only to other public http(s) URLs
+class _PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        _check_public_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+_opener = urllib.request.build_opener(_PublicRedirectHandler)
+
+# Downloads or copies one image into the uploads folder and returns its URL
+def _fetch_image(line_number, source, upload_folder, timeout, max_bytes):
+    kind, location = source
+    if kind == 'file':
+        filename = _upload_name(line_number, os.path.basename(location))
+        shutil.copyfile(location, os.path.join(upload_folder, filename))
+        return f'/static/uploads/{filename}'
+
+    _check_public_url(location)
+    with _opener.open(location, timeout=timeout) as response:
+        # The server's content type decides, whatever the URL ends in
+        content_type = response.headers.get_content_type()
+        if content_type not in IMAGE_CONTENT_TYPES:
+            raise ProductImportError(f'{location} is not a png, jpg or gif image')
+        basename = os.path.splitext(os.path.basename(urlparse(location).path))[0] or 'image'
+        basename = f'{basename}.{IMAGE_CONTENT_TYPES[content_type]}'
+        data = response.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ProductImportError(f'{location} is larger than {max_bytes // (1024 * 1024)}MB')
+    filename = _upload_name(line_number, basename)
+    with open(os.path.join(upload_folder, filename), 'wb') as f:
+        f.write(data)
+    return f'/static/uploads/{filename}'
+
+def _remove_uploads(urls):
+    for url in urls:
+        try:
+            os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], url.rsplit('/', 1)[-1]))
+        except OSError:
+            pass
+
+def _count(lines):
+    return {action: sum(1 for line in lines if line['action'] == action)
+            for action in ('create', 'update', 'unchanged', 'error')}
+
+# Validates rows and, unless dry_run, applies them. Returns a report with a
+# line per row: its action (create, update, unchanged or error), the
+# product, and the old and new value of every changed field. Nothing is
+# written unless every row is valid and every image was fetched.
+def import_products(rows, dry_run=False, images_dir=None, workers=8, timeout=10, max_bytes=16 * 1024 * 1024):
+    columns = (Product.id, Product.name, Product.description, Product.price,
+               Product.image_url, Product.category, Product.stock)
+    products_by_id = {}
+    products_by_name = {}
+    for product in db.session.query(*columns):
+        products_by_id[product.id] = product
+        products_by_name.setdefault(product.name, []).append(product)
+
+    lines = []
+    seen = {}
+    for line_number, row in rows:
+        product, values, errors = _validate(row, products_by_id, products_by_name)
+        key = product.id if product is not None else values.get('name')
+        if key is not None and key in seen:
+            errors.append(f'same product as line {seen[key]}')
+        seen.setdefault(key, line_number)
+
+        source = None
+        image = values.pop('image', None)
+        if image is not None and not (product is not None and image == product.image_url):
+            source, error = _image_source(image, images_dir)
+            if error:
+                errors.append(error)
+
+        changes = {}
+        for field, value in values.items():
+            old = getattr(product, field) if product is not None else None
+            if old != value:
+                changes[field] = (old, value)
+        # Until it is fetched, a new image is shown as written in the file
+        if source is not None:
+            changes['image_url'] = (product.image_url if product is not None else None, image)
+
+        if errors:
+            action = 'error'
+        elif product is None:
+            action = 'create'
+        else:
+            action = 'update' if changes else 'unchanged'
+        lines.append({
+            'line': line_number,
+            'action': action,
+            'product_id': product.id if product is not None else None,
+            'name': values.get('name') or (product.name if product is not None else row.get('name')),
+            'changes': changes,
+            'errors': errors,
+            'source': source
+        })
+
+    report = {
+        'dry_run': dry_run,
+        'applied': False,
+        'lines': lines,
+        'counts': _count(lines)
+    }
+    if report['counts']['error'] or dry_run:
+        return report
+
+    # Images are fetched side by side; downloads spend their time waiting
+    # on the network, not on the GIL
+    pending = [line for line in lines if line['source'] and line['source'][0] != 'keep']
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    saved = []
+    if pending:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='product-import') as executor:
+            futures = [(line, executor.submit(_fetch_image, line['line'], line['source'], upload_folder,
+                                              timeout, max_bytes)) for line in pending]
+            for line, future in futures:
+                try:
+                    url = future.result()
+                except Exception as e:
+                    line['action'] = 'error'
+                    line['errors'].append(f'image could not be fetched: {e}')
+                    continue
+                saved.append(url)
+                line['changes']['image_url'] = (line['changes']['image_url'][0], url)
+        if any(line['action'] == 'error' for line in pending):
+            _remove_uploads(saved)
+            report['counts'] = _count(lines)
+            return report
+
+    inserts = []
+    updates = []
+    for line in lines:
+        values = {field: new for field, (old, new) in line['changes'].items()}
+        if line['action'] == 'create':
+            values.setdefault('stock', 0)
+            values['created_at'] = datetime.utcnow()
+            inserts.append(values)
+        elif line['action'] == 'update':
+            # Every update sets the same columns so they run as one batch
+            current = products_by_id[line['product_id']]
+            updates.append({
+                'b_id': current.id,
+                **{field: values.get(field, getattr(current, field)) for field in
+                   ('name', 'description', 'price', 'image_url', 'category', 'stock')}
+            })
+
+    try:
+        if inserts:
+            db.session.execute(Product.__table__.insert(), inserts)
+        if updates:
+            # The SET clause comes from the keys of the parameter rows
+            db.session.execute(update(Product.__table__).where(Product.__table__.c.id == bindparam('b_id')), updates)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _remove_uploads(saved)
+        raise
+    report['applied'] = True
+    return report
@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+
+# In-process token-bucket limiter. Each scope ('ip', 'account', ...) has its
+# own burst size and refill rate; a request is identified by one key per
+# scope and is only let through if every bucket still has a token.
+class RateLimiter:
+    def __init__(self, limits=None, max_keys=10000):
+        # scope -> (burst, tokens refilled per minute)
+        self.limits = dict(limits or {})
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected_requests = 0
+        self.rejected_by_scope = {}
+
+    def init_app(self, app):
+        self.limits = {
+            'ip': (app.config['AUTH_RATE_LIMIT_IP_BURST'], app.config['AUTH_RATE_LIMIT_IP_PER_MINUTE']),
+            'account': (app.config['AUTH_RATE_LIMIT_ACCOUNT_BURST'], app.config['AUTH_RATE_LIMIT_ACCOUNT_PER_MINUTE'])
+        }
+
+    def _refill(self, scope, key, now):
+        burst, per_minute = self.limits[scope]
+        tokens, updated = self._buckets.get((scope, key), (burst, now))
+        tokens = min(burst, tokens + (now - updated) * per_minute / 60.0)
+        return tokens
+
+    # Takes one token from each bucket, or none at all if any bucket is empty
+    def allow(self, **keys):
+        now = time.monotonic()
+        keys = {scope: key for scope, key in keys.items() if key is not None and scope in self.limits}
+        with self._lock:
+            levels = {scope: self._refill(scope, key, now) for scope, key in keys.items()}
+            empty = [scope for scope, tokens in levels.items() if tokens < 1]
+            if empty:
+                self.rejected_requests += 1
+                for scope in empty:
+                    self.rejected_by_scope[scope] = self.rejected_by_scope.get(scope, 0) + 1
+                for scope, key in keys.items():
+                    self._store((scope, key), levels[scope], now)
+                return False
+            for scope, key in keys.items():
+                self._store((scope, key), levels[scope] - 1, now)
+            self.allowed += 1
+            return True
+
+    def _store(self, bucket, tokens, now):
+        self._buckets[bucket] = (tokens, now)
+        self._buckets.move_to_end(bucket)
+        # Forgetting the least recently used bucket only resets it to full
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self.allowed = 0
+            self.rejected_requests = 0
+            self.rejected_by_scope = {}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked_keys': len(self._buckets),
+                'allowed': self.allowed,
+                'rejected': self.rejected_requests,
+                'rejected_by_scope': dict(self.rejected_by_scope)
+            }
+
+auth_limiter = RateLimiter()
@@ -0,0 +1,231 @@
+import threading
+import time
+from sqlalchemy import text
+from models import db, Product, Topping, ProductRecommendation
+
+# "Frequently bought together". An offline job turns the order history into
+# co-occurrence counts and keeps only each product's top neighbours in
+# product_recommendation; web workers read that small table into memory, so
+# serving a suggestion is a dict lookup. numpy is only imported by the
+# offline job, so the web workers never load it.
+
+# Distinct (order, product) pairs of every order that wasn't cancelled
+BASKETS_SQL = text('''
+    SELECT DISTINCT order_id, product_id
+    FROM (SELECT i.order_id, i.product_id
+          FROM order_item i JOIN "order" o ON o.id = i.order_id
+          WHERE o.status != 'cancelled'
+          UNION ALL
+          SELECT i.order_id, i.product_id
+          FROM archived_order_item i JOIN archived_order o ON o.id = i.order_id
+          WHERE o.status != 'cancelled')
+    ORDER BY order_id
+''')
+
+# How often each topping was chosen for each product. Customizations are
+# archived with their order items, so hot and archived rows are both read.
+TOPPING_COUNTS_SQL = text('''
+    SELECT product_id, topping_id, COUNT(*)
+    FROM (SELECT i.product_id, ct.topping_id
+          FROM customization_toppings ct
+          JOIN customization c ON c.id = ct.customization_id
+          JOIN order_item i ON i.id = c.order_item_id
+          JOIN "order" o ON o.id = i.order_id
+          WHERE o.status != 'cancelled'
+          UNION ALL
+          SELECT i.product_id, ct.topping_id
+          FROM archived_customization_toppings ct
+          JOIN archived_customization c ON c.id = ct.customization_id
+          JOIN archived_order_item i ON i.id = c.order_item_id
+          JOIN archived_order o ON o.id = i.order_id
+          WHERE o.status != 'cancelled')
+    GROUP BY product_id, topping_id
+''')
+
+CUSTOMIZATION_COUNTS_SQL = text('''
+    SELECT product_id, COUNT(*)
+    FROM (SELECT i.product_id
+          FROM customization c
+          JOIN order_item i ON i.id = c.order_item_id
+          JOIN "order" o ON o.id = i.order_id
+          WHERE o.status != 'cancelled'
+          UNION ALL
+          SELECT i.product_id
+          FROM archived_customization c
+          JOIN archived_order_item i ON i.id = c.order_item_id
+          JOIN archived_order o ON o.id = i.order_id
+          WHERE o.status != 'cancelled')
+    GROUP BY product_id
+''')
+
+# Product pairs counted per block of orders, so the pairs of a large order
+# history are never all held at once
+BLOCK_PAIRS = 4 * 1024 * 1024
+
+# Maps raw ids onto positions in ids, a sorted array; -1 for unknown ids
+def _positions(ids, values):
+    import numpy as np
+    if not len(ids):
+        return np.full(len(values), -1)
+    slot = np.minimum(np.searchsorted(ids, values), len(ids) - 1)
+    return np.where(ids[slot] == values, slot, -1)
+
+# Both products of every pair inside each order, as (first, second) position
+# arrays with first < second. rows are the baskets' order numbers, sorted.
+def _basket_pairs(rows, columns):
+    import numpy as np
+    ends = np.searchsorted(rows, rows, side='right')
+    partners = ends - np.arange(len(rows)) - 1
+    left = np.repeat(np.arange(len(rows)), partners)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(partners) - partners, partners)
+    right = left + 1 + offsets
+    return np.minimum(columns[left], columns[right]), np.maximum(columns[left], columns[right])
+
+# How many orders contain each pair of products, as (first, second, count)
+# arrays over the pairs seen at least once with first < second, plus the
+# number of orders containing each product. Only pairs that occur are ever
+# stored: each is encoded as first * n + second and counted with np.unique,
+# a block of orders at a time.
+def product_cooccurrence(baskets, product_ids):
+    import numpy as np
+    n = len(product_ids)
+    columns = _positions(product_ids, baskets[:, 1])
+    known = columns >= 0
+    orders, rows = np.unique(baskets[known, 0], return_inverse=True)
+    columns = columns[known]
+    orders_with = np.bincount(columns, minlength=n)
+
+    # Orders per block, from the size of the biggest basket
+    largest = int(np.bincount(rows).max()) if len(rows) else 1
+    block = max(1, BLOCK_PAIRS // max(largest * largest, 1))
+    codes, counts = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for start in range(0, len(orders), block):
+        # Baskets are sorted by order, so each block is a contiguous slice
+        lo, hi = np.searchsorted(rows, [start, start + block])
+        first, second = _basket_pairs(rows[lo:hi], columns[lo:hi])
+        block_codes, block_counts = np.unique(first * n + second, return_counts=True)
+        codes.append(block_codes)
+        counts.append(block_counts)
+
+    codes, inverse = np.unique(np.concatenate(codes), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+    return codes // max(n, 1), codes % max(n, 1), counts, orders_with
+
+# Best `top_k` entries of each row with a positive score, as (row, column,
+# score, rank) arrays; equal scores go to the lower column
+def top_neighbours(rows, columns, scores, top_k):
+    import numpy as np
+    keep = scores > 0
+    rows, columns, scores = rows[keep], columns[keep], scores[keep]
+    order = np.lexsort((columns, -scores, rows))
+    rows, columns, scores = rows[order], columns[order], scores[order]
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    best = ranks < top_k
+    return rows[best], columns[best], scores[best], ranks[best]
+
+# Rebuilds product_recommendation from the order history and returns the
+# number of rows written.
+#
+# Products are scored by cosine similarity of their baskets, so a flavour in
+# every order doesn't top every list; pairs seen together fewer than
+# min_support times are ignored. Toppings are scored by the share of the
+# product's customizations that chose them.
+def build_recommendations(top_k=5, min_support=2):
+    import numpy as np
+    from forecast import int_array
+
+    product_ids = np.array([row[0] for row in db.session.query(Product.id).order_by(Product.id)], dtype=np.int64)
+    topping_ids = np.array([row[0] for row in db.session.query(Topping.id).order_by(Topping.id)], dtype=np.int64)
+
+    baskets = int_array(db.session.execute(BASKETS_SQL), 2)
+    first, second, together, orders_with = product_cooccurrence(baskets, product_ids)
+    supported = together >= min_support
+    first, second, together = first[supported], second[supported], together[supported]
+    similarity = together / np.sqrt(orders_with[first] * orders_with[second])
+    # Each pair recommends both ways
+    product_scores = (np.concatenate([first, second]), np.concatenate([second, first]),
+                      np.concatenate([similarity, similarity]))
+
+    pairs = int_array(db.session.execute(TOPPING_COUNTS_SQL), 3)
+    customized = int_array(db.session.execute(CUSTOMIZATION_COUNTS_SQL), 2)
+    customizations = np.zeros(len(product_ids))
+    rows = _positions(product_ids, customized[:, 0])
+    customizations[rows[rows >= 0]] = customized[rows >= 0, 1]
+    rows, columns = _positions(product_ids, pairs[:, 0]), _positions(topping_ids, pairs[:, 1])
+    known = (rows >= 0) & (columns >= 0) & (pairs[:, 2] >= min_support)
+    rows, columns = rows[known], columns[known]
+    topping_scores = (rows, columns, pairs[known, 2] / customizations[rows])
+
+    records = []
+    for kind, scores, related_ids in (('product', product_scores, product_ids),
+                                      ('topping', topping_scores, topping_ids)):
+        rows, columns, values, ranks = top_neighbours(*scores, top_k)
+        records.extend({
+            'product_id': int(product_id),
+            'kind': kind,
+            'related_id': int(related_id),
+            'score': round(float(score), 4),
+            'rank': int(rank)
+        } for product_id, related_id, score, rank in zip(product_ids[rows], related_ids[columns], values, ranks))
+
+    ProductRecommendation.query.delete()
+    if records:
+        db.session.execute(ProductRecommendation.__table__.insert(), records)
+    db.session.commit()
+    return len(records)
+
+# The product_recommendation table of this process, as product id ->
+# {'product': [ids], 'topping': [ids]} best first. The table only changes
+# when the job runs, so each worker reloads it every max_age seconds.
+class RecommendationIndex:
+    def __init__(self, max_age=600):
+        self.max_age = max_age
+        self._index = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+
+    def init_app(self, app):
+        self.max_age = app.config.get('RECOMMENDATIONS_MAX_AGE', self.max_age)
+
+    def index(self):
+        index = self._index
+        if index is not None and time.monotonic() - self._loaded_at < self.max_age:
+            return index
+        with self._lock:
+            if self._index is None or time.monotonic() - self._loaded_at >= self.max_age:
+                index = {}
+                rows = db.session.query(ProductRecommendation.product_id, ProductRecommendation.kind,
+                                        ProductRecommendation.related_id).order_by(ProductRecommendation.rank)
+                for product_id, kind, related_id in rows:
+                    index.setdefault(product_id, {'product': [], 'topping': []})[kind].append(related_id)
+                self._index = index
+                self._loaded_at = time.monotonic()
+            return self._index
+
+    def for_product(self, product_id, kind='product'):
+        self.lookups += 1
+        entry = self.index().get(product_id)
+        return list(entry[kind]) if entry else []
+
+    # Neighbours of everything in a cart, best ranked first, leaving out
+    # what is already in it
+    def for_cart(self, product_ids, limit=4):
+        self.lookups += 1
+        index = self.index()
+        in_cart = set(product_ids)
+        best = {}
+        for product_id in in_cart:
+            for rank, related_id in enumerate(index.get(product_id, {}).get('product', [])):
+                if related_id not in in_cart:
+                    best[related_id] = min(rank, best.get(related_id, rank))
+        return sorted(best, key=lambda related_id: (best[related_id], related_id))[:limit]
+
+    def stats(self):
+        index = self._index
+        return {
+            'products': len(index) if index is not None else None,
+            'lookups': self.lookups
+        }
+
+recommendations = RecommendationIndex()
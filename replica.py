@@ -0,0 +1,136 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm, text
+
+# Read/write splitting. Views decorated with read_replica send their queries
+# to the 'replica' bind in SQLALCHEMY_BINDS; flushes, and every view without
+# the decorator, use the primary. Without a replica bind nothing changes.
+#
+# A browser that committed a write recently keeps reading from the primary
+# for REPLICA_READ_YOUR_WRITES seconds, so a customer never sees a replica
+# that hasn't caught up with their own checkout yet.
+REPLICA_BIND = 'replica'
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context() and g.get('read_replica'):
+            return replica_router.engine(self.app)
+        return super().get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _record_flush(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+# Bulk UPDATE/DELETE queries and Core statements run through session.execute
+# write without a flush
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _record_statement(execute_state):
+    if not execute_state.is_select:
+        execute_state.session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_write(db_session):
+    if db_session.info.pop('wrote', False) and has_request_context():
+        replica_router.remember_write()
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_write(db_session):
+    db_session.info.pop('wrote', None)
+
+class ReplicaRouter:
+    def __init__(self, read_your_writes=15, ready_check_interval=5):
+        self.read_your_writes = read_your_writes
+        self.ready_check_interval = ready_check_interval
+        self.enabled = False
+        self._ready = False
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self.replica_requests = 0
+        self.primary_requests = 0
+
+    def init_app(self, app):
+        self.enabled = REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {})
+        self.read_your_writes = app.config.get('REPLICA_READ_YOUR_WRITES', self.read_your_writes)
+
+    def engine(self, app):
+        return app.extensions['sqlalchemy'].db.get_engine(app, bind=REPLICA_BIND)
+
+    def remember_write(self):
+        session['primary_until'] = time.time() + self.read_your_writes
+
+    # The replica is used once a snapshot has been written to it; until
+    # then (a fresh deploy) reads stay on the primary
+    def ready(self, app):
+        if self._ready or time.monotonic() - self._checked_at < self.ready_check_interval:
+            return self._ready
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                with self.engine(app).connect() as connection:
+                    self._ready = connection.execute(
+                        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product'")
+                    ).first() is not None
+            except Exception:
+                self._ready = False
+        return self._ready
+
+    def should_read_replica(self, app):
+        use = self.enabled and time.time() >= session.get('primary_until', 0) and self.ready(app)
+        if use:
+            self.replica_requests += 1
+        else:
+            self.primary_requests += 1
+        return use
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'ready': self._ready,
+            'replica_requests': self.replica_requests,
+            'primary_requests': self.primary_requests
+        }
+
+replica_router = ReplicaRouter()
+
+# Marks a view as read-only so its queries may be served by the replica
+def read_replica(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.read_replica = replica_router.should_read_replica(current_app)
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Sends the queries in the block to the primary even inside a read_replica
+# view, for readers that must see everything the order event feed has seen
+@contextmanager
+def use_primary():
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('read_replica', False)
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        g.read_replica = previous
+
+# Local replica stand-in: copies the primary SQLite file into the replica
+# file with SQLite's online backup API. The copy is one transaction on the
+# replica, so readers see either the old or the new snapshot.
+def snapshot_replica(db, app):
+    primary = sqlite3.connect(db.get_engine(app).url.database)
+    replica = sqlite3.connect(db.get_engine(app, bind=REPLICA_BIND).url.database, timeout=30)
+    try:
+        primary.backup(replica)
+    finally:
+        replica.close()
+        primary.close()
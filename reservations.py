@@ -0,0 +1,174 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import db, Product, StockReservation
+
+# A cart that can't become an order as it stands
+class CheckoutError(Exception):
+    pass
+
+class InsufficientStock(CheckoutError):
+    def __init__(self, product, available):
+        super().__init__(f'Only {available} of {product.name} available')
+        self.product = product
+        self.available = available
+
+# Time-boxed stock holds for checkouts.
+#
+# Loading /payment replaces the checkout's holds with its current cart, so
+# items can't sell out to other carts while the customer is paying. Holds
+# stop counting once they expire; a sweeper thread per worker deletes expired
+# rows in batches. Available stock is product.stock minus the units held,
+# and the held totals are cached per process instead of being summed on
+# every cart request.
+class ReservationService:
+    def __init__(self, ttl=600, cache_ttl=5, sweep_interval=30, sweep_batch=500):
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.app = None
+        self._totals = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self.reserved = 0
+        self.rejected = 0
+        self.swept = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get('RESERVATION_TTL', self.ttl)
+        self.cache_ttl = app.config.get('RESERVATION_CACHE_TTL', self.cache_ttl)
+        self.sweep_interval = app.config.get('RESERVATION_SWEEP_INTERVAL', self.sweep_interval)
+        self.sweep_batch = app.config.get('RESERVATION_SWEEP_BATCH', self.sweep_batch)
+
+    # Units held per product across every live checkout, reloaded with one
+    # GROUP BY at most every cache_ttl seconds
+    def held_totals(self):
+        totals = self._totals
+        if totals is not None and time.monotonic() - self._loaded_at < self.cache_ttl:
+            return totals
+        with self._lock:
+            if self._totals is None or time.monotonic() - self._loaded_at >= self.cache_ttl:
+                self._totals = self._held(datetime.utcnow())
+                self._loaded_at = time.monotonic()
+            return self._totals
+
+    def invalidate(self):
+        with self._lock:
+            self._totals = None
+
+    # Units of a product free for the checkout `key`: its stock minus what
+    # every other live checkout holds, so a customer back from /payment can
+    # still keep or add to the items they are holding themselves
+    def available(self, product, key=None):
+        held = self.held_totals().get(product.id, 0)
+        if key is not None:
+            held -= self.held_by(key).get(product.id, 0)
+        return product.stock - max(held, 0)
+
+    # Live holds of one checkout, {product_id: quantity}
+    def held_by(self, key):
+        return dict(db.session.query(StockReservation.product_id, func.sum(StockReservation.quantity))
+                    .filter(StockReservation.checkout_key == key, StockReservation.expires_at > datetime.utcnow())
+                    .group_by(StockReservation.product_id).all())
+
+    # Live holds per product, read from the database rather than the cache,
+    # optionally leaving one checkout's own holds out
+    def held_by_others(self, key, product_ids):
+        return self._held(datetime.utcnow(), product_ids, exclude_key=key)
+
+    def _held(self, now, product_ids=None, exclude_key=None):
+        query = db.session.query(StockReservation.product_id, func.sum(StockReservation.quantity)) \
+            .filter(StockReservation.expires_at > now)
+        if product_ids is not None:
+            query = query.filter(StockReservation.product_id.in_(product_ids))
+        if exclude_key is not None:
+            query = query.filter(StockReservation.checkout_key != exclude_key)
+        return dict(query.group_by(StockReservation.product_id).all())
+
+    # Replaces a checkout's holds with the given {product_id: quantity} of
+    # existing products and commits. The check reads the live holds, not the cache. Raises
+    # InsufficientStock, holding nothing, if another checkout got there first.
+    def reserve(self, key, quantities):
+        self._ensure_sweeper()
+        now = datetime.utcnow()
+        # Deleting first takes SQLite's write lock, so concurrent checkouts
+        # check and insert their holds one at a time
+        StockReservation.query.filter_by(checkout_key=key).delete(synchronize_session=False)
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(quantities))}
+        held = self._held(now, list(quantities))
+        for product_id, quantity in quantities.items():
+            product = products[product_id]
+            available = product.stock - held.get(product_id, 0)
+            if quantity > available:
+                db.session.rollback()
+                self.rejected += 1
+                raise InsufficientStock(product, max(available, 0))
+
+        expires_at = now + timedelta(seconds=self.ttl)
+        db.session.add_all([
+            StockReservation(checkout_key=key, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for product_id, quantity in quantities.items()
+        ])
+        db.session.commit()
+        self.reserved += 1
+        self.invalidate()
+        return expires_at
+
+    # Drops a checkout's holds as part of the caller's transaction
+    def release(self, key):
+        StockReservation.query.filter_by(checkout_key=key).delete(synchronize_session=False)
+        self.invalidate()
+
+    # Deletes expired holds in batches so the sweeper never holds the write
+    # lock for long
+    def sweep(self):
+        swept = 0
+        while True:
+            expired = db.session.query(StockReservation.id) \
+                .filter(StockReservation.expires_at <= datetime.utcnow()) \
+                .limit(self.sweep_batch)
+            deleted = StockReservation.query.filter(StockReservation.id.in_(expired)) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+            swept += deleted
+            if deleted < self.sweep_batch:
+                break
+        self.swept += swept
+        return swept
+
+    # Started by the first reservation so no thread exists before a pre-fork
+    # server forks its workers
+    def _ensure_sweeper(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sweep_loop, name='reservation-sweeper', daemon=True)
+                self._thread.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                with self.app.app_context():
+                    self.sweep()
+                    db.session.remove()
+            except Exception:
+                self.app.logger.exception('Reservation sweeper failed')
+
+    def stats(self):
+        totals = self._totals or {}
+        return {
+            'ttl': self.ttl,
+            'held_products': len(totals),
+            'held_units': sum(totals.values()),
+            'reserved': self.reserved,
+            'rejected': self.rejected,
+            'swept': self.swept
+        }
+
+reservations = ReservationService()
@@ -0,0 +1,103 @@
+import re
+from sqlalchemy import text
+from models import db
+
+# Full-text product search backed by an SQLite FTS5 external-content index.
+# The index reads its text from the product table and triggers keep it in
+# sync on every insert, update and delete, whichever code path writes.
+SEARCH_INDEX_DDL = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        name, description, category,
+        content='product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )''',
+    '''CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF name, description, category ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO product_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END''',
+    # Browsing without a query pages through products in name order
+    'CREATE INDEX IF NOT EXISTS ix_product_name ON product (name, id)',
+    'CREATE INDEX IF NOT EXISTS ix_product_category_name ON product (category, name, id)',
+]
+
+# bm25 weights for name, description and category
+RANK = 'bm25(product_fts, 10.0, 1.0, 4.0)'
+
+MAX_PER_PAGE = 100
+
+def create_search_index(rebuild=True):
+    for statement in SEARCH_INDEX_DDL:
+        db.session.execute(text(statement))
+    if rebuild:
+        # Re-read every product so rows written before the triggers existed are indexed
+        db.session.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+# Turns free text into an FTS5 query where every word must match as a prefix,
+# so "choc dre" finds "Chocolate Dream". Quoting each token keeps FTS5
+# operators typed by the user from being interpreted.
+def build_match_query(q):
+    tokens = re.findall(r'\w+', q or '')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+def search_products(q='', category=None, min_price=None, max_price=None, page=1, per_page=20):
+    page = max(page, 1)
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+    params = {'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    filters = []
+    if category:
+        filters.append('p.category = :category')
+        params['category'] = category
+    if min_price is not None:
+        filters.append('p.price >= :min_price')
+        params['min_price'] = min_price
+    if max_price is not None:
+        filters.append('p.price <= :max_price')
+        params['max_price'] = max_price
+
+    match = build_match_query(q)
+    if match:
+        params['match'] = match
+        # CROSS JOIN pins the loop order so SQLite drives the lookup from the
+        # FTS match instead of scanning products by category or price first.
+        # Every match is ranked; with a LIMIT, SQLite keeps only the best
+        # offset + limit rows while sorting.
+        sql = f'''SELECT p.id, p.name, p.description, p.price, p.image_url, p.category, p.stock,
+                         {RANK} AS score
+                  FROM product_fts CROSS JOIN product p ON p.id = product_fts.rowid
+                  WHERE product_fts MATCH :match {''.join(' AND ' + f for f in filters)}
+                  ORDER BY score, p.id
+                  LIMIT :limit OFFSET :offset'''
+    else:
+        where = ' WHERE ' + ' AND '.join(filters) if filters else ''
+        sql = f'''SELECT p.id, p.name, p.description, p.price, p.image_url, p.category, p.stock
+                  FROM product p{where}
+                  ORDER BY p.name, p.id
+                  LIMIT :limit OFFSET :offset'''
+
+    rows = db.session.execute(text(sql), params).fetchall()
+    return {
+        'results': [{
+            'id': row.id,
+            'name': row.name,
+            'description': row.description,
+            'price': row.price,
+            'image': row.image_url,
+            'category': row.category,
+            'stock': row.stock
+        } for row in rows[:per_page]],
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(rows) > per_page
+    }
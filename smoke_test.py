@@ -0,0 +1,120 @@
+# Smoke test for the production server: starts Gunicorn with
+# gunicorn.conf.py, fires parallel requests at the storefront and catalog
+# APIs, and checks that they all succeed and were served by more than one
+# worker at the same time.
+#
+#     flask init-db              # once, so the database exists
+#     python smoke_test.py [--requests 64] [--concurrency 16] [--workers 2]
+#
+# Exits non-zero if the server doesn't start, any request fails or only one
+# worker answered.
+import argparse
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+PATHS = ['/', '/api/ice-creams', '/api/v2/ice-creams', '/api/pricing', '/api/search?q=choc']
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_until_up(base_url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(base_url + '/api/pricing', timeout=2):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+def fetch(url):
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError as e:
+        status = str(e)
+    return url, status, started, time.monotonic()
+
+# Most requests that were in flight at the same moment
+def peak_overlap(results):
+    edges = sorted([(started, 1) for _, _, started, _ in results] + [(ended, -1) for _, _, _, ended in results])
+    peak = current = 0
+    for _, change in edges:
+        current += change
+        peak = max(peak, current)
+    return peak
+
+def main():
+    parser = argparse.ArgumentParser(description='Start Gunicorn and check it serves parallel requests.')
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(args.workers))
+    # The worker pid goes in every access log line, to see who served what
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logformat', 'pid=%(p)s %(s)s %(U)s',
+         'wsgi:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    log = []
+    reader = threading.Thread(target=lambda: log.extend(process.stdout), daemon=True)
+    reader.start()
+
+    try:
+        if not wait_until_up(base_url, process):
+            print('Gunicorn did not start:')
+            print(''.join(log))
+            return 1
+
+        urls = [base_url + PATHS[i % len(PATHS)] for i in range(args.requests)]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(fetch, urls))
+        elapsed = time.monotonic() - started
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=35)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        reader.join(timeout=5)
+
+    failures = [(url, status) for url, status, _, _ in results if status != 200]
+    pids = set(re.findall(r'pid=<?(\d+)', ''.join(log)))
+    busy = sum(ended - started for _, _, started, ended in results)
+    print(f'{len(results)} requests, {args.concurrency} at a time, in {elapsed:.2f}s '
+          f'({busy:.2f}s of request time)')
+    print(f'Peak requests in flight: {peak_overlap(results)}; workers that answered: {len(pids)}')
+    for url, status in failures:
+        print(f'FAILED {url}: {status}')
+    if failures:
+        return 1
+    if args.workers > 1 and len(pids) < 2:
+        print('FAILED: every request was served by a single worker')
+        return 1
+    print('OK')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
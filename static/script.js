@@ -154,40 +154,48 @@ document.addEventListener('DOMContentLoaded', function() {
     const cartTotal = document.getElementById('cart-total');
     const checkoutBtn = document.getElementById('checkout-btn');
 
+    // Escape text before it is placed in the cart markup, quotes included:
+    // customized cart keys hold JSON and end up inside attributes
+    const HTML_ESCAPES = { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' };
+    function escapeHtml(value) {
+        return String(value).replace(/[&<>"']/g, character => HTML_ESCAPES[character]);
+    }
+
+    // Render a priced cart in one pass: build the markup as a single string
+    // and assign it once instead of re-parsing the list for every item
+    function renderCart(data) {
+        cartItems.innerHTML = data.items.map(item => `
+            <div class="d-flex justify-content-between align-items-center mb-2">
+                <div>
+                    <h6 class="mb-0">${escapeHtml(item.name)}</h6>
+                    <small class="text-muted">₹${item.price.toFixed(2)} x ${item.quantity}</small>
+                </div>
+                <div>
+                    <button class="btn btn-sm btn-outline-danger remove-from-cart" data-key="${escapeHtml(item.key)}">Remove</button>
+                </div>
+            </div>
+        `).join('');
+
+        cartTotal.textContent = data.total.toFixed(2);
+        checkoutBtn.style.display = data.items.length > 0 ? 'inline-block' : 'none';
+    }
+
+    function handleCartResponse(response) {
+        if (response.status === 401) {
+            window.location.href = '/login';
+            return null;
+        }
+        return response.json();
+    }
+
     // Update cart display
     function updateCartDisplay() {
         fetch('/api/cart/items')
-            .then(response => {
-                if (!response.ok) {
-                    if (response.status === 401) {
-                        window.location.href = '/login';
-                        return;
-                    }
-                    throw new Error('Network response was not ok');
-                }
-                return response.json();
-            })
+            .then(handleCartResponse)
             .then(data => {
-                cartItems.innerHTML = '';
-                let total = 0;
-
-                data.items.forEach(item => {
-                    total += item.total;
-                    cartItems.innerHTML += `
-                        <div class="d-flex justify-content-between align-items-center mb-2">
-                            <div>
-                                <h6 class="mb-0">${item.name}</h6>
-                                <small class="text-muted">₹${item.price.toFixed(2)} x ${item.quantity}</small>
-                            </div>
-                            <div>
-                                <button class="btn btn-sm btn-outline-danger" onclick="removeFromCart(${item.id})">Remove</button>
-                            </div>
-                        </div>
-                    `;
-                });
-
-                cartTotal.textContent = total.toFixed(2);
-                checkoutBtn.style.display = data.items.length > 0 ? 'inline-block' : 'none';
+                if (data) {
+                    renderCart(data);
+                }
             })
             .catch(error => {
                 console.error('Error:', error);
@@ -195,58 +203,67 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
 
+    // Send cart changes in one request; the response already holds the
+    // updated, priced cart so no second fetch is needed
+    function updateCart(operations) {
+        return fetch('/api/cart/batch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': document.querySelector('meta[name="csrf-token"]').content
+            },
+            body: JSON.stringify({ operations: operations })
+        })
+        .then(handleCartResponse)
+        .then(data => {
+            if (data && data.status === 'success') {
+                renderCart(data);
+            }
+            return data;
+        });
+    }
+
     // Add to cart
     const addToCartButtons = document.querySelectorAll('.add-to-cart');
     addToCartButtons.forEach(button => {
         button.addEventListener('click', function() {
-            const productId = this.dataset.productId;
-            fetch('/api/cart/add', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-CSRFToken': document.querySelector('meta[name="csrf-token"]').content
-                },
-                body: JSON.stringify({
-                    product_id: productId,
-                    quantity: 1
+            updateCart([{ op: 'add', product_id: this.dataset.productId, quantity: 1 }])
+                .then(data => {
+                    if (data && data.status === 'success') {
+                        cartModal.show();
+                    } else if (data) {
+                        alert('Error adding item to cart: ' + data.message);
+                    }
                 })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.status === 'success') {
-                    updateCartDisplay();
-                    cartModal.show();
-                } else {
-                    alert('Error adding item to cart: ' + data.message);
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                alert('Error adding item to cart');
-            });
+                .catch(error => {
+                    console.error('Error:', error);
+                    alert('Error adding item to cart');
+                });
         });
     });
 
-    // Remove from cart
-    const removeFromCartButtons = document.querySelectorAll('.remove-from-cart');
-    removeFromCartButtons.forEach(button => {
-        button.addEventListener('click', function() {
-            const productId = this.dataset.productId;
-            fetch('/api/cart/remove', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-CSRFToken': document.querySelector('meta[name="csrf-token"]').content
-                },
-                body: JSON.stringify({
-                    product_id: productId
-                })
-            })
-            .then(response => response.json())
+    // Remove from cart: one delegated listener covers the cart modal and the
+    // cart page, and removes exactly the line that was clicked
+    document.addEventListener('click', function(event) {
+        const button = event.target.closest('.remove-from-cart');
+        if (!button) {
+            return;
+        }
+        updateCart([{ op: 'remove', key: button.dataset.key }])
             .then(data => {
-                if (data.status === 'success') {
-                    updateCartDisplay();
-                } else {
+                if (data && data.status === 'success') {
+                    const row = button.closest('tr');
+                    if (row) {
+                        row.remove();
+                        // Cart page: show the new total, or the empty cart
+                        const pageTotal = document.getElementById('cart-page-total');
+                        if (data.items.length === 0) {
+                            window.location.reload();
+                        } else if (pageTotal) {
+                            pageTotal.textContent = '₹' + data.total.toFixed(2);
+                        }
+                    }
+                } else if (data) {
                     alert('Error removing item from cart: ' + data.message);
                 }
             })
@@ -254,7 +271,6 @@ document.addEventListener('DOMContentLoaded', function() {
                 console.error('Error:', error);
                 alert('Error removing item from cart');
             });
-        });
     });
 
     // Initial cart display
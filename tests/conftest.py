@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from config import Config
+from init_db import init_db
+
+# The order event hub, kitchen queue and other per-process services are
+# module-level singletons that remember event ids, so every test shares one
+# app and one database rather than starting over
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    root = tmp_path_factory.mktemp('shop')
+
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{root / 'test.db'}"
+        SQLALCHEMY_BINDS = {}
+        UPLOAD_FOLDER = str(root / 'uploads')
+        JINJA_CACHE_DIR = str(root / 'jinja_cache')
+        AUTH_RATE_LIMIT_IP_BURST = 1000
+        AUTH_RATE_LIMIT_ACCOUNT_BURST = 1000
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        init_db()
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+# A client signed in as the seeded admin, which can also shop
+@pytest.fixture
+def admin_client(client):
+    client.post('/login', data={'email': 'admin@example.com', 'password': 'admin123'})
+    client.post('/admin/login', data={'email': 'admin@example.com', 'password': 'admin123'})
+    return client
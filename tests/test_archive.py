@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+from archive import archive_orders
+from models import (db, Order, OrderItem, Topping, Customization, customization_toppings, ArchivedOrder,
+                    ArchivedCustomization, archived_customization_toppings)
+
+def test_archive_moves_customizations_with_their_items(app):
+    with app.app_context():
+        topping = Topping(name='Sprinkles', price=0.5)
+        old = Order(user_id=1, status='delivered', total_amount=5,
+                    updated_at=datetime.utcnow() - timedelta(days=400))
+        db.session.add_all([topping, old])
+        db.session.flush()
+        item = OrderItem(order_id=old.id, product_id=1, quantity=1, price=5)
+        db.session.add(item)
+        db.session.flush()
+        customization = Customization(order_item_id=item.id, size='small', container='cone', toppings=[topping])
+        # The newest order always stays hot
+        db.session.add_all([customization, Order(user_id=1, status='pending', total_amount=5)])
+        db.session.commit()
+        order_id, customization_id = old.id, customization.id
+
+        assert archive_orders(older_than=365) >= 1
+
+        assert db.session.get(ArchivedOrder, order_id) is not None
+        assert Customization.query.filter_by(id=customization_id).count() == 0
+        assert db.session.query(customization_toppings).filter_by(customization_id=customization_id).count() == 0
+        assert ArchivedCustomization.query.filter_by(id=customization_id).count() == 1
+        assert db.session.query(archived_customization_toppings) \
+            .filter_by(customization_id=customization_id).count() == 1
@@ -0,0 +1,18 @@
+from models import Order
+
+def test_paid_order_gets_kitchen_eta(app, admin_client):
+    admin_client.post('/api/cart/batch', json={'operations': [{'op': 'add', 'product_id': 1, 'quantity': 2}]})
+    assert admin_client.get('/payment').status_code == 200
+    with admin_client.session_transaction() as session:
+        key = session['checkout_key']
+
+    response = admin_client.get(f'/payment/success?key={key}')
+    assert response.status_code == 302
+    with app.app_context():
+        order = Order.query.filter_by(idempotency_key=key).one()
+        assert order.status == 'pending'
+        order_id = order.id
+
+    data = admin_client.get(f'/order/{order_id}/eta').get_json()
+    assert data['eta'] is not None
+    assert data['eta']['position'] >= 1
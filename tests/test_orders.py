@@ -0,0 +1,19 @@
+from models import Order
+
+def test_replayed_place_order_returns_the_first_order(app, admin_client):
+    admin_client.post('/api/cart/batch', json={'operations': [{'op': 'add', 'product_id': 1, 'quantity': 1}]})
+    assert admin_client.get('/checkout').status_code == 200
+    with admin_client.session_transaction() as session:
+        sent = dict(session)
+
+    first = admin_client.post('/place-order')
+    assert first.status_code == 302
+
+    # A retry sends the cookie of the original request, cart and key included
+    with admin_client.session_transaction() as session:
+        session.update(sent)
+    second = admin_client.post('/place-order')
+    assert second.headers['Location'] == first.headers['Location']
+
+    with app.app_context():
+        assert Order.query.filter_by(idempotency_key=sent['checkout_key']).count() == 1
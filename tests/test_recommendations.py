@@ -0,0 +1,21 @@
+import numpy as np
+from recommendations import product_cooccurrence, top_neighbours
+
+def test_cooccurrence_counts_only_pairs_seen():
+    product_ids = np.array([10, 20, 30], dtype=np.int64)
+    # Order 1 has 10 and 20, order 2 has 10, 20 and 30, order 3 has an unknown product
+    baskets = np.array([[1, 10], [1, 20], [2, 10], [2, 20], [2, 30], [3, 99]], dtype=np.int64)
+
+    first, second, counts, orders_with = product_cooccurrence(baskets, product_ids)
+
+    assert list(zip(first, second, counts)) == [(0, 1, 2), (0, 2, 1), (1, 2, 1)]
+    assert list(orders_with) == [2, 2, 1]
+
+def test_top_neighbours_ranks_each_row():
+    rows = np.array([0, 0, 0, 1])
+    columns = np.array([1, 2, 3, 0])
+    scores = np.array([0.5, 0.9, 0.5, 0.0])
+
+    rows, columns, scores, ranks = top_neighbours(rows, columns, scores, 2)
+
+    assert list(zip(rows, columns, ranks)) == [(0, 2, 0), (0, 1, 1)]
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+
+# Lightweight stand-in for User holding only the fields request handling and
+# templates read from current_user. Routes that modify the account must load
+# the real User row instead.
+class CachedUser(UserMixin):
+    def __init__(self, id, username, email, is_admin):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.is_admin = bool(is_admin)
+
+# Per-process LRU cache with a TTL for Flask-Login's user_loader. Other
+# workers only see profile changes once their entry expires, so keep the TTL
+# short.
+class UserCache:
+    def __init__(self, ttl=60, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+        self.max_size = app.config.get('USER_CACHE_SIZE', self.max_size)
+
+    def get(self, user_id, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = loader(user_id)
+        if user is None:
+            return None
+
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+user_cache = UserCache()
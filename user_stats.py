@@ -0,0 +1,143 @@
+from sqlalchemy import func, text
+from sqlalchemy.dialects.sqlite import insert
+from models import db, OrderItem, UserStats, UserProductStats
+
+# Incremental per-customer statistics. Every change is an upsert that adds a
+# delta in the caller's transaction, so concurrent orders from one customer
+# can't overwrite each other's totals and the profile never re-reads the
+# order history.
+
+# The favorite is the product with the most units bought; the rank index
+# makes this a lookup of the top entry for the user
+FAVORITE_SQL = text('''
+    UPDATE user_stats SET favorite_product_id = (
+        SELECT product_id FROM user_product_stats
+        WHERE user_id = :user_id AND quantity > 0
+        ORDER BY quantity DESC, product_id
+        LIMIT 1)
+    WHERE user_id = :user_id
+''')
+
+def _apply(user_id, sign, amount, quantities, placed_at=None):
+    values = {'user_id': user_id, 'order_count': sign, 'lifetime_spend': sign * amount}
+    if placed_at is not None:
+        values['last_order_at'] = placed_at
+    stmt = insert(UserStats).values(**values)
+    update = {
+        'order_count': UserStats.order_count + stmt.excluded.order_count,
+        'lifetime_spend': UserStats.lifetime_spend + stmt.excluded.lifetime_spend
+    }
+    if placed_at is not None:
+        update['last_order_at'] = func.max(func.coalesce(UserStats.last_order_at, stmt.excluded.last_order_at),
+                                           stmt.excluded.last_order_at)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['user_id'], set_=update))
+
+    if quantities:
+        stmt = insert(UserProductStats).values([
+            {'user_id': user_id, 'product_id': product_id, 'quantity': sign * quantity}
+            for product_id, quantity in quantities.items()
+        ])
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['user_id', 'product_id'],
+            set_={'quantity': UserProductStats.quantity + stmt.excluded.quantity}
+        ))
+    db.session.execute(FAVORITE_SQL, {'user_id': user_id})
+
+# A new order; quantities is {product_id: units} of the items written with it
+def record_order(order, quantities):
+    _apply(order.user_id, 1, order.total_amount, quantities, placed_at=order.created_at)
+
+# Cancelling an order takes it out of the totals; moving it back out of
+# cancelled puts it back
+def record_status_change(order_id, user_id, total_amount, old_status, new_status):
+    record_status_changes([(order_id, user_id, total_amount, old_status)], new_status)
+
+# The same for many orders moved to one status, as (order id, user id,
+# total amount, old status) rows. Deltas are summed per customer and per
+# customer and product, so the whole batch costs one item query and one
+# executemany per table however many orders it covers.
+def record_status_changes(rows, new_status):
+    signs = {}
+    users = {}
+    for order_id, user_id, total_amount, old_status in rows:
+        if old_status == new_status or 'cancelled' not in (old_status, new_status):
+            continue
+        sign = -1 if new_status == 'cancelled' else 1
+        signs[order_id] = (user_id, sign)
+        order_count, spend = users.get(user_id, (0, 0))
+        users[user_id] = (order_count + sign, spend + sign * total_amount)
+    if not users:
+        return
+
+    products = {}
+    items = db.session.query(OrderItem.order_id, OrderItem.product_id, func.sum(OrderItem.quantity)) \
+        .filter(OrderItem.order_id.in_(list(signs))) \
+        .group_by(OrderItem.order_id, OrderItem.product_id)
+    for order_id, product_id, quantity in items:
+        user_id, sign = signs[order_id]
+        products[user_id, product_id] = products.get((user_id, product_id), 0) + sign * quantity
+
+    stmt = insert(UserStats)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['user_id'], set_={
+        'order_count': UserStats.order_count + stmt.excluded.order_count,
+        'lifetime_spend': UserStats.lifetime_spend + stmt.excluded.lifetime_spend
+    }), [
+        {'user_id': user_id, 'order_count': order_count, 'lifetime_spend': spend}
+        for user_id, (order_count, spend) in users.items()
+    ])
+    if products:
+        stmt = insert(UserProductStats)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['user_id', 'product_id'],
+            set_={'quantity': UserProductStats.quantity + stmt.excluded.quantity}
+        ), [
+            {'user_id': user_id, 'product_id': product_id, 'quantity': quantity}
+            for (user_id, product_id), quantity in products.items()
+        ])
+    db.session.execute(FAVORITE_SQL, [{'user_id': user_id} for user_id in users])
+
+# Adds the profile's order index to existing databases and fills the
+# statistics the first time they are created
+def create_user_stats():
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_order_user_created ON "order" (user_id, created_at)'))
+    db.session.commit()
+    if UserStats.query.first() is None:
+        rebuild_user_stats()
+
+# Recomputes every customer's statistics from the order history, hot and
+# archived
+def rebuild_user_stats():
+    db.session.execute(text('DELETE FROM user_product_stats'))
+    db.session.execute(text('DELETE FROM user_stats'))
+    db.session.execute(text('''
+        INSERT INTO user_stats (user_id, order_count, lifetime_spend, last_order_at)
+        SELECT user_id,
+               SUM(CASE WHEN status = 'cancelled' THEN 0 ELSE 1 END),
+               SUM(CASE WHEN status = 'cancelled' THEN 0 ELSE total_amount END),
+               MAX(created_at)
+        FROM (SELECT user_id, status, total_amount, created_at FROM "order"
+              UNION ALL
+              SELECT user_id, status, total_amount, created_at FROM archived_order)
+        GROUP BY user_id
+    '''))
+    db.session.execute(text('''
+        INSERT INTO user_product_stats (user_id, product_id, quantity)
+        SELECT user_id, product_id, SUM(quantity)
+        FROM (SELECT o.user_id, i.product_id, i.quantity
+              FROM order_item i JOIN "order" o ON o.id = i.order_id
+              WHERE o.status != 'cancelled'
+              UNION ALL
+              SELECT o.user_id, i.product_id, i.quantity
+              FROM archived_order_item i JOIN archived_order o ON o.id = i.order_id
+              WHERE o.status != 'cancelled')
+        GROUP BY user_id, product_id
+    '''))
+    db.session.execute(text('''
+        UPDATE user_stats SET favorite_product_id = (
+            SELECT product_id FROM user_product_stats s
+            WHERE s.user_id = user_stats.user_id AND s.quantity > 0
+            ORDER BY s.quantity DESC, s.product_id
+            LIMIT 1)
+    '''))
+    db.session.commit()
+    return UserStats.query.count()
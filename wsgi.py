@@ -0,0 +1,5 @@
+from app import create_app, warm_templates
+
+# Entry point for production servers, e.g. `gunicorn -c gunicorn.conf.py wsgi:app`
+app = create_app()
+warm_templates(app)